@@ -1,6 +1,19 @@
+import sys
+
 from flask_script import Server, Shell, Manager, Command, prompt_bool
 from flask_migrate import MigrateCommand
-from surveys import create_app, db
+from flask import current_app
+from flask_babel import force_locale
+from surveys import create_app, db, survey
+from surveys.assets import AssetsCommand
+from surveys.bench import BenchCommand
+from surveys.columnar import export_parquet
+from surveys.export import export_incremental
+from surveys.helper import rebuild_respondents, verify_tallies, create_csv
+from surveys.ingest import ingest as ingest_answers
+from surveys.loadtest import load as load_test
+from surveys.mail import dead_letters, resend_dead_letters
+from surveys.session import session_store
 
 
 manager = Manager(create_app)
@@ -9,6 +22,104 @@ manager.add_option('-c', '--config', dest='configfile', required=False)
 manager.add_command('runserver', Server())
 manager.add_command('shell', Shell())
 manager.add_command('db', MigrateCommand)
+manager.add_command('bench', BenchCommand)
+manager.add_command('assets', AssetsCommand)
+
+
+@manager.command
+def backfill_respondents():
+    """Rebuild the respondent summary table from the answers"""
+    print('{} respondents'.format(rebuild_respondents()))
+
+
+@manager.option('-o', '--output', dest='output', required=True,
+                help='output file')
+@manager.option('-f', '--format', dest='fmt', default='csv',
+                choices=('csv', 'parquet'), help='export format')
+@manager.option('-l', '--lang', dest='lang', default='raw',
+                help='language of the labels or raw')
+@manager.option('--checkpoint', dest='checkpoint', default=None,
+                help='only export respondents touched since this checkpoint')
+def export(output, fmt='csv', lang='raw', checkpoint=None):
+    """Export the survey results to a csv or Parquet file"""
+    raw = lang not in current_app.config['LANGUAGES']
+    locale = current_app.config['LANGUAGES_LOCALE'].get(lang, 'en')
+    with force_locale(locale):
+        if fmt == 'parquet':
+            total = export_parquet(output, survey.FORMS, raw=raw)
+            print('{} respondents'.format(total))
+        elif checkpoint:
+            with open(output, 'w') as csvfile:
+                total = export_incremental(csvfile, survey.FORMS, checkpoint,
+                                           sep=',', internal_sep=';', raw=raw)
+            db.session.commit()
+            print('{} respondents'.format(total))
+        else:
+            with open(output, 'w') as csvfile:
+                create_csv(csvfile, survey.FORMS,
+                           sep=',', internal_sep=';', raw=raw)
+
+
+@manager.option('--resend', dest='resend', action='store_true',
+                help='send the undelivered messages again')
+def mail_failures(resend=False):
+    """List messages the outbox gave up sending"""
+    for path, letter in dead_letters(current_app):
+        print('{}: {!r} to {} failed at {}: {}'.format(
+            path, letter['subject'], ', '.join(letter['recipients']),
+            letter['failed_at'], letter['error']))
+    if resend:
+        print('{} sent, {} failed'.format(*resend_dead_letters(current_app)))
+
+
+@manager.command
+def purge_sessions():
+    """Delete expired server-side sessions"""
+    if current_app.config['SESSION_BACKEND'] == 'cookie':
+        print('Sessions are stored in cookies')
+        return
+    print('{} expired sessions deleted'.format(
+        session_store(current_app).purge()))
+
+
+@manager.option('path', help='NDJSON file of answer records or - for stdin')
+@manager.option('--chunk', dest='chunk', type=int, default=None,
+                help='rows per transaction')
+def ingest(path, chunk=None):
+    """Write answers collected offline from an NDJSON file"""
+    if path == '-':
+        result = ingest_answers(sys.stdin, chunk=chunk)
+    else:
+        with open(path, encoding='utf-8') as lines:
+            result = ingest_answers(lines, chunk=chunk)
+    for error in result['errors']:
+        print('line {line}: {error}'.format(**error))
+    print('{written} written, {skipped} skipped, {rejected} rejected in '
+          '{seconds}s ({rows_per_second} rows/s)'.format(**result))
+
+
+@manager.option('-n', '--respondents', dest='respondents', type=int,
+                default=100, help='simulated respondents per profile')
+@manager.option('-c', '--concurrency', dest='concurrency', type=int,
+                default=8, help='concurrent respondents')
+@manager.option('-p', '--profiles', dest='profiles', default=None,
+                help='comma separated ENGINE_PROFILES, default: default '
+                     'and the profile auto selects')
+def load(respondents=100, concurrency=8, profiles=None):
+    """Surveys per second of concurrent respondents by engine profile"""
+    load_test(respondents, concurrency,
+              profiles.split(',') if profiles else None)
+
+
+@manager.option('--fix', dest='fix', action='store_true',
+                help='rewrite the counters from the recount')
+def verify_stats(fix=False):
+    """Compare the /stats/ counters with a full recount of the answers"""
+    mismatches = verify_tallies(fix=fix)
+    for key, (stored, counted) in sorted(mismatches.items()):
+        print('{}: stored {} counted {}'.format('.'.join(key), stored, counted))
+    print('{} mismatches{}'.format(
+        len(mismatches), ' fixed' if fix and mismatches else ''))
 
 if __name__ == '__main__':
     manager.run()
\ No newline at end of file
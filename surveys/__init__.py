@@ -17,12 +17,18 @@ from flask_appconfig import AppConfig
 from flask_bootstrap import Bootstrap
 from flask_babel import Babel
 
-from .frontend import frontend
+from . import survey
+from .assets import init_assets
+from .catalog import init_catalogs
+from .compress import init_compression
+from .frontend import frontend, init_navbar, init_translations
 from .nav import nav, init_custom_nav_renderer
 from .babel import babel
-from .db import db, migrate
-from .helper import question_url
-from .mail import mail
+from .db import db, migrate, init_engine_profile
+from .buffer import init_answer_buffer
+from .session import init_session
+from .helper import question_url, init_fragment_cache
+from .mail import mail, init_outbox
 
 
 def create_app(configfile=None):
@@ -48,21 +54,35 @@ def create_app(configfile=None):
     app.config['BOOTSTRAP_SERVE_LOCAL'] = True
     app.config['JSON_AS_ASCII'] = False
     app.config['JSON_SORT_KEYS'] = False
+    init_assets(app)
     # We initialize the navigation as well
     nav.init_app(app)
     init_custom_nav_renderer(app)
+    init_navbar(app)
 
     # Localization
     babel.init_app(app)
+    init_translations(app)
+    init_catalogs(app, survey.FORMS, survey.TITLES)
 
     # Jinja question_url
     app.jinja_env.globals.update(question_url=question_url)
+    init_fragment_cache(app)
 
     # Database
+    init_engine_profile(app)
     db.init_app(app)
     migrate.init_app(app, db)
+    init_answer_buffer(app)
+
+    # Sessions
+    init_session(app)
 
     # Email
     mail.init_app(app)
+    init_outbox(app)
+
+    # Response compression
+    init_compression(app)
 
     return app
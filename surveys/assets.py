@@ -0,0 +1,244 @@
+"""Fingerprinted static assets with far-future cache headers
+
+Build them after changing files under surveys/static:
+
+    $ python manage.py assets vendor
+    $ python manage.py assets build --minify
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+from urllib.request import urlopen
+
+from flask import Blueprint, current_app, request, url_for, send_file, abort
+from flask_bootstrap import StaticCDN, ConditionalCDN
+from flask_script import Manager
+
+AssetsCommand = Manager(usage='Build fingerprinted static assets')
+assets = Blueprint('assets', __name__)
+
+ONE_YEAR = 365 * 24 * 3600
+IMMUTABLE = 'public, max-age={}, immutable'.format(ONE_YEAR)
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.eot', '.ttf', '.html')
+CSS_URL_RE = re.compile(r'''url\((['"]?)([^)'"?#]+)([^)'"]*)\1\)''')
+
+SELECT2_FILES = ('css/select2.min.css', 'js/select2.min.js')
+
+
+def asset_sources(app):
+    """Return (logical prefix, directory) of the files to fingerprint"""
+    bootstrap = app.blueprints['bootstrap'].static_folder
+    return [('', app.static_folder), ('bootstrap/', bootstrap)]
+
+
+def walk(directory):
+    """Yield file paths under directory relative to it, sorted"""
+    for root, _, files in sorted(os.walk(directory)):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, directory).replace(os.sep, '/')
+
+
+def fingerprint(name, content):
+    """Return name with the content hash before the extension"""
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    base, ext = os.path.splitext(name)
+    return '{}.{}{}'.format(base, digest, ext)
+
+
+def minify(name, content):
+    """Minify css and js with rcssmin/rjsmin, if they are installed"""
+    if '.min.' in name:
+        return content
+    try:
+        if name.endswith('.css'):
+            from rcssmin import cssmin
+            return cssmin(content.decode('utf-8')).encode('utf-8')
+        if name.endswith('.js'):
+            from rjsmin import jsmin
+            return jsmin(content.decode('utf-8')).encode('utf-8')
+    except ImportError:
+        pass
+    return content
+
+
+def rewrite_css(name, content, manifest):
+    """Point relative url() references of a stylesheet to hashed files"""
+    folder = os.path.dirname(name)
+
+    def replace(match):
+        """Replace one url()"""
+        target = os.path.normpath(os.path.join(folder, match.group(2)))
+        target = target.replace(os.sep, '/')
+        if target not in manifest:
+            return match.group(0)
+        hashed = os.path.relpath(manifest[target], folder or '.')
+        return 'url({0}{1}{2}{0})'.format(
+            match.group(1), hashed.replace(os.sep, '/'), match.group(3))
+
+    return CSS_URL_RE.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def compress(path, content):
+    """Write gzip and, if available, brotli versions next to path"""
+    with gzip.GzipFile(path + '.gz', 'wb', compresslevel=9, mtime=0) as out:
+        out.write(content)
+    try:
+        import brotli
+    except ImportError:
+        return
+    with open(path + '.br', 'wb') as out:
+        out.write(brotli.compress(content))
+
+
+def build_assets(app, output, minified=False, compressed=True):
+    """Fingerprint static files into output and write manifest.json"""
+    if os.path.isdir(output):
+        shutil.rmtree(output)
+    sources = []
+    for prefix, directory in asset_sources(app):
+        skip = os.path.relpath(output, directory)
+        sources += [
+            (prefix + name, os.path.join(directory, name))
+            for name in walk(directory)
+            if not name.startswith(skip + '/')
+        ]
+    # Stylesheets last, so their url() targets are already fingerprinted
+    sources.sort(key=lambda item: item[0].endswith('.css'))
+    manifest = {}
+    for name, path in sources:
+        with open(path, 'rb') as source:
+            content = source.read()
+        if minified:
+            content = minify(name, content)
+        if name.endswith('.css'):
+            content = rewrite_css(name, content, manifest)
+        manifest[name] = fingerprint(name, content)
+        target = os.path.join(output, manifest[name])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as out:
+            out.write(content)
+        if compressed and name.endswith(COMPRESSIBLE):
+            compress(target, content)
+    with open(os.path.join(output, 'manifest.json'), 'w') as out:
+        json.dump(manifest, out, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(app):
+    """Return the manifest of the last build or an empty one"""
+    try:
+        with open(os.path.join(app.config['ASSET_DIRECTORY'],
+                               'manifest.json')) as manifest:
+            return json.load(manifest)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def asset_url(filename, fallback=None):
+    """Return the fingerprinted url of a static file.
+
+    Files missing from the build use the static route, or fallback if they do
+    not exist at all
+    """
+    manifest = current_app.extensions['assets']
+    if filename in manifest:
+        return url_for('assets.asset', filename=manifest[filename])
+    if fallback is not None and not os.path.isfile(
+            os.path.join(current_app.static_folder, filename)):
+        return fallback
+    return url_for('static', filename=filename)
+
+
+class AssetCDN(object):
+    """Flask-Bootstrap CDN that prefers fingerprinted files"""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, cdn, prefix):
+        self.cdn = cdn
+        self.prefix = prefix
+
+    def get_resource_url(self, filename):
+        """Return resource url for filename"""
+        manifest = current_app.extensions['assets']
+        if self.prefix + filename in manifest:
+            return asset_url(self.prefix + filename)
+        return self.cdn.get_resource_url(filename)
+
+
+def wrap_cdn(cdn):
+    """Wrap local Flask-Bootstrap CDNs in AssetCDN"""
+    if isinstance(cdn, ConditionalCDN):
+        cdn.primary = wrap_cdn(cdn.primary)
+        return cdn
+    if isinstance(cdn, StaticCDN):
+        prefix = 'bootstrap/' if cdn.static_endpoint != 'static' else ''
+        return AssetCDN(cdn, prefix)
+    return cdn
+
+
+@assets.route('/assets/<path:filename>')
+def asset(filename):
+    """Serve a fingerprinted file, precompressed if the client accepts it"""
+    directory = current_app.config['ASSET_DIRECTORY']
+    path = os.path.realpath(os.path.join(directory, filename))
+    if not path.startswith(os.path.realpath(directory) + os.sep):
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    accepted = request.accept_encodings
+    encoding = None
+    for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if accepted[name] > 0 and os.path.isfile(path + suffix):
+            encoding, path = name, path + suffix
+            break
+    response = send_file(path, mimetype=mimetype, conditional=True,
+                         cache_timeout=ONE_YEAR)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_assets(app):
+    """Load the asset manifest and register asset_url"""
+    app.extensions['assets'] = load_manifest(app)
+    app.register_blueprint(assets)
+    app.jinja_env.globals.update(asset_url=asset_url)
+    cdns = app.extensions['bootstrap']['cdns']
+    for name, cdn in list(cdns.items()):
+        cdns[name] = wrap_cdn(cdn)
+
+
+@AssetsCommand.option('--minify', dest='minified', action='store_true',
+                      help='minify css and js with rcssmin and rjsmin')
+@AssetsCommand.option('--no-compress', dest='uncompressed',
+                      action='store_true',
+                      help='do not write .gz and .br files')
+def build(minified=False, uncompressed=False):
+    """Fingerprint static files into ASSET_DIRECTORY"""
+    output = current_app.config['ASSET_DIRECTORY']
+    manifest = build_assets(current_app, output, minified=minified,
+                            compressed=not uncompressed)
+    print('{} assets written to {}'.format(len(manifest), output))
+
+
+@AssetsCommand.option('--version', dest='version', default='4.0.3',
+                      help='select2 version')
+def vendor(version='4.0.3'):
+    """Download select2 into surveys/static/vendor/select2"""
+    url = current_app.config['SELECT2_URL']
+    target = os.path.join(current_app.static_folder, 'vendor', 'select2')
+    for name in SELECT2_FILES:
+        path = os.path.join(target, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with urlopen(url.format(version=version, path=name)) as source, \
+                open(path, 'wb') as out:
+            shutil.copyfileobj(source, out)
+        print('Wrote {}'.format(path))
@@ -0,0 +1,894 @@
+"""Performance benchmarks
+
+Run them against a scratch database, e.g.:
+
+    $ DATABASE_URL=sqlite:///bench.db python manage.py bench answers
+"""
+import datetime
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+from functools import wraps
+from io import StringIO
+from itertools import groupby
+from urllib.parse import urlparse
+
+from flask import session, current_app, flash
+from flask_babel import gettext
+from flask_script import Manager
+from sqlalchemy import inspect
+
+from . import survey
+from .db import db, Answer, write_answer
+from .columnar import export_parquet, columnar_layout
+from .export import export_csv, export_incremental, merge_csv
+from .export import reset_checkpoint
+from .helper import save_answer, stream_csv, respondent_answers, create_csv
+from .helper import verify_tallies, goto, set_navbar
+from .ingest import ingest as ingest_lines
+
+BenchCommand = Manager(usage='Run performance benchmarks')
+
+
+def synthetic_answer(rnd, form_class):
+    """Return a random submission for a survey form"""
+    if form_class._mode == 'radio':
+        choices = list(form_class.survey_schema().choices['options'])
+        return {'options': rnd.choice(choices)}
+    data = {}
+    for field in form_class.survey_fields():
+        if form_class._mode == 'check' and not field.endswith('_e'):
+            if field + '_e' in data:
+                data[field] = 'Specify' if data[field + '_e'] else ''
+            else:
+                data[field] = rnd.random() < 0.3
+        elif form_class._mode == 'check':
+            data[field] = rnd.random() < 0.1
+        else:
+            data[field] = 'text {}'.format(rnd.randint(0, 1000))
+    return data
+
+
+def synthetic_rows(rnd, uid, start):
+    """Yield answer rows of a synthetic respondent"""
+    lang = rnd.choice(['en', 'ptbr'])
+    answers = [('origin', {'submit': 'main'}), ('index', {'submit': 'yes'})]
+    answers += [
+        (number, synthetic_answer(rnd, form_class))
+        for number, form_class in survey.FORMS.items()
+    ]
+    if rnd.random() < 0.7:
+        answers.append(('finish', {'submit': 'final'}))
+    for position, (number, data) in enumerate(answers):
+        created_at = start + datetime.timedelta(seconds=position * 20)
+        for field, value in data.items():
+            if value:
+                yield {
+                    'uid': uid, 'question': number, 'lang': lang,
+                    'field': field, 'value': str(value),
+                    'created_at': created_at,
+                }
+
+
+def fill(respondents, chunk=10000, seed=0):
+    """Fill the answer table with synthetic respondents"""
+    rnd = random.Random(seed)
+    start = datetime.datetime(2017, 1, 1)
+    rows, total = [], 0
+    for index in range(respondents):
+        uid = '{:048x}'.format(rnd.getrandbits(192))
+        rows.extend(synthetic_rows(
+            rnd, uid, start + datetime.timedelta(minutes=index)
+        ))
+        if len(rows) >= chunk:
+            db.session.execute(Answer.__table__.insert(), rows)
+            db.session.commit()
+            total += len(rows)
+            rows = []
+    if rows:
+        db.session.execute(Answer.__table__.insert(), rows)
+        db.session.commit()
+        total += len(rows)
+    return total
+
+
+def timed(func, repeat):
+    """Run func repeat times. Return durations in milliseconds"""
+    result = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        result.append((time.perf_counter() - start) * 1000)
+    return result
+
+
+def report(name, durations):
+    """Print mean, p50 and p95 of durations"""
+    durations = sorted(durations)
+    count = len(durations)
+    print('{:<28} n={:<6} mean={:9.3f}ms p50={:9.3f}ms p95={:9.3f}ms'.format(
+        name, count, sum(durations) / count,
+        durations[count // 2], durations[min(count - 1, int(count * 0.95))]
+    ))
+
+
+def set_indexes(enabled):
+    """Create or drop Answer indexes"""
+    existing = {
+        index['name'] for index in inspect(db.engine).get_indexes('answer')
+    }
+    for index in Answer.__table__.indexes:
+        if enabled and index.name not in existing:
+            index.create(bind=db.engine)
+        elif not enabled and index.name in existing:
+            index.drop(bind=db.engine)
+
+
+def measure_answers(uids, requests, export):
+    """Measure save, per-respondent lookup and export latency"""
+    rnd = random.Random(1)
+    numbers = list(survey.FORMS.keys())
+
+    def save():
+        session['s_uid'] = rnd.choice(uids)
+        number = rnd.choice(numbers)
+        save_answer(number, synthetic_answer(rnd, survey.FORMS[number]))
+
+    def lookup():
+        query = Answer.query.filter_by(uid=rnd.choice(uids))
+        for _ in respondent_answers(query):
+            pass
+
+    def export_csv():
+        for _ in stream_csv(survey.FORMS):
+            pass
+
+    report('save_answer', timed(save, requests))
+    report('respondent lookup', timed(lookup, requests))
+    if export:
+        report('full export', timed(export_csv, 1))
+
+
+@BenchCommand.option('-r', '--respondents', dest='respondents', type=int,
+                     default=100000, help='synthetic respondents to insert')
+@BenchCommand.option('-n', '--requests', dest='requests', type=int,
+                     default=200, help='requests per measurement')
+@BenchCommand.option('--no-fill', dest='no_fill', action='store_true',
+                     help='reuse the answers already in the database')
+@BenchCommand.option('--no-export', dest='no_export', action='store_true',
+                     help='skip the full export measurement')
+def answers(respondents, requests, no_fill=False, no_export=False):
+    """Answer table latency before and after the indexes"""
+    db.create_all()
+    if not no_fill:
+        start = time.perf_counter()
+        total = fill(respondents)
+        print('Inserted {} answers in {:.1f}s'.format(
+            total, time.perf_counter() - start))
+    uids = [uid for uid, in db.session.query(Answer.uid).distinct().limit(
+        1000
+    )]
+    session['s_lang'] = 'en'
+    for enabled in (False, True):
+        set_indexes(enabled)
+        current_app.config['ANSWER_UPSERT'] = enabled
+        print('== {} indexes'.format('with' if enabled else 'without'))
+        measure_answers(uids, requests, not no_export)
+
+
+def in_memory_attachment():
+    """Build the csv attachment in a StringIO"""
+    csvfile = StringIO()
+    create_csv(csvfile, survey.FORMS, sep=',', internal_sep=';')
+    return csvfile.getvalue().encode('utf-8')
+
+
+def spooled_attachment(compression):
+    """Build the attachment in a spooled temporary file"""
+    def build():
+        """Read the compressed export"""
+        with export_csv(survey.FORMS, compression, sep=',',
+                        internal_sep=';') as result:
+            return result.read()
+    return build
+
+
+def peak_memory(func):
+    """Run func. Return duration, peak traced memory and result size"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = len(func())
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak, size
+
+
+@BenchCommand.option('-r', '--rows', dest='rows', type=int,
+                     default=1000000, help='minimum synthetic answer rows')
+@BenchCommand.option('--no-fill', dest='no_fill', action='store_true',
+                     help='reuse the answers already in the database')
+def export(rows, no_fill=False):
+    """Peak memory of in-memory and compressed result exports"""
+    db.create_all()
+    if not no_fill:
+        total = 0
+        while total < rows:
+            total += fill(1000, seed=total)
+        print('Inserted {} answers'.format(total))
+    print('{} answers'.format(Answer.query.count()))
+    builders = [('in memory csv', in_memory_attachment)] + [
+        (compression + ' spool', spooled_attachment(compression))
+        for compression in ('csv', 'gzip', 'zip')
+    ]
+    for name, func in builders:
+        duration, peak, size = peak_memory(func)
+        print('{:<28} time={:7.1f}s peak={:8.1f}MB attachment={:8.1f}MB'.format(
+            name, duration, peak / 2 ** 20, size / 2 ** 20))
+
+
+def aggregate_csv(path):
+    """Load the csv and count every check and radio answer"""
+    import pandas as pd
+    frame = pd.read_csv(path, dtype=str, keep_default_na=False)
+    counts = {}
+    for number, form_class in survey.FORMS.items():
+        if form_class._mode == 'check':
+            counts[number] = frame[number].str.split(';').explode(
+            ).value_counts()
+        elif form_class._mode == 'radio':
+            counts[number] = frame[number].value_counts()
+    return counts
+
+
+def aggregate_parquet(path):
+    """Load the Parquet file and count every check and radio answer"""
+    import pandas as pd
+    frame = pd.read_parquet(path)
+    counts = {}
+    for number, form_class in survey.FORMS.items():
+        if form_class._mode == 'check':
+            columns = [
+                column.name for column in columnar_layout({number: form_class})
+                if column.kind == 'bool'
+            ]
+            counts[number] = frame[columns].fillna(False).astype(bool).sum()
+        elif form_class._mode == 'radio':
+            counts[number] = frame[number + '_options'].value_counts()
+    return counts
+
+
+@BenchCommand.option('-r', '--respondents', dest='respondents', type=int,
+                     default=0, help='synthetic respondents to insert first')
+@BenchCommand.option('-n', '--requests', dest='requests', type=int,
+                     default=5, help='loads per format')
+def columnar(respondents, requests):
+    """Notebook load and aggregate time of the csv and Parquet exports"""
+    db.create_all()
+    if respondents:
+        fill(respondents)
+    directory = tempfile.mkdtemp()
+    csv_path = directory + '/survey_result.csv'
+    parquet_path = directory + '/survey_result.parquet'
+
+    def write_csv():
+        """Write the export the notebook reads today"""
+        with open(csv_path, 'w') as csvfile:
+            create_csv(csvfile, survey.FORMS, sep=',', internal_sep=';')
+
+    report('write csv', timed(write_csv, 1))
+    report('write parquet', timed(
+        lambda: export_parquet(parquet_path, survey.FORMS), 1))
+    for path in (csv_path, parquet_path):
+        print('{:<28} {:8.1f}KB'.format(
+            path.rsplit('/', 1)[1], os.path.getsize(path) / 1024))
+    report('load+aggregate csv', timed(
+        lambda: aggregate_csv(csv_path), requests))
+    report('load+aggregate parquet', timed(
+        lambda: aggregate_parquet(parquet_path), requests))
+    shutil.rmtree(directory)
+
+
+@BenchCommand.option('-r', '--respondents', dest='respondents', type=int,
+                     default=0, help='synthetic respondents to insert first')
+@BenchCommand.option('-n', '--new', dest='new', type=int,
+                     default=20, help='respondents written between exports')
+def incremental(respondents, new):
+    """Full export against a checkpointed export merged into the last csv"""
+    db.create_all()
+    if respondents:
+        fill(respondents)
+    directory = tempfile.mkdtemp()
+    full_path = directory + '/full.csv'
+    previous_path = directory + '/previous.csv'
+    delta_path = directory + '/delta.csv'
+    merged_path = directory + '/merged.csv'
+    reset_checkpoint('bench')
+    with open(previous_path, 'w') as csvfile:
+        export_incremental(csvfile, survey.FORMS, 'bench')
+    db.session.commit()
+
+    rnd = random.Random(2)
+    fill(new // 2, seed=rnd.getrandbits(32))
+    uids = [uid for uid, in db.session.query(Answer.uid).distinct().limit(
+        new - new // 2)]
+    for uid in uids:
+        number = rnd.choice(list(survey.FORMS))
+        write_answer(uid, number, 'en',
+                     synthetic_answer(rnd, survey.FORMS[number]))
+    db.session.commit()
+
+    def full():
+        """Export every respondent"""
+        with open(full_path, 'w') as csvfile:
+            create_csv(csvfile, survey.FORMS)
+
+    def delta():
+        """Export touched respondents and merge them"""
+        with open(delta_path, 'w') as csvfile:
+            print('{} touched respondents'.format(export_incremental(
+                csvfile, survey.FORMS, 'bench')))
+        db.session.rollback()
+        with open(previous_path) as previous, open(delta_path) as changes, \
+                open(merged_path, 'w') as output:
+            merge_csv(previous, changes, output)
+
+    report('full export', timed(full, 1))
+    report('incremental export+merge', timed(delta, 1))
+    with open(full_path) as full_file, open(merged_path) as merged_file:
+        same = sorted(full_file) == sorted(merged_file)
+    print('merged export matches full export: {}'.format(same))
+    reset_checkpoint('bench')
+    shutil.rmtree(directory)
+
+
+@BenchCommand.option('-n', '--requests', dest='requests', type=int,
+                     default=200, help='requests per measurement')
+def countries(requests):
+    """Country choice list with and without the per-locale cache"""
+    from .forms import Country, country_choices
+    for locale in ('en', 'pt_BR'):
+        report('uncached choices ' + locale, timed(
+            lambda: country_choices.__wrapped__(locale), requests))
+        report('cached choices ' + locale, timed(
+            lambda: country_choices(locale), requests))
+    report('Country form', timed(Country, requests))
+
+
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def form_data(rnd, number):
+    """Return POST data of a synthetic answer"""
+    if number == 'index':
+        return {'submit': 'Start'}
+    form_class = survey.FORMS.get(number)
+    if form_class is None:
+        return {'submit': 'Next'}
+    data = {'submit': 'Next'}
+    if number == 't2':
+        data['options'] = 'no'
+    elif number == 'p6':
+        data['country'] = 'BRA'
+    elif number == 'c3':
+        data['email'] = 'respondent@example.com'
+    else:
+        for field, value in synthetic_answer(rnd, form_class).items():
+            if value is True:
+                data[field] = 'y'
+            elif value:
+                data[field] = str(value)
+    return data
+
+
+def client_app():
+    """Return a new app with the current config for test clients.
+
+    Test client requests reuse an app context that is already pushed for the
+    same app, which would share flask.g (and CSRF tokens) across requests
+    """
+    from . import create_app
+    app = create_app()
+    app.config.update(current_app.config)
+    return app
+
+
+def walk_survey(client, lang='en', seed=0, on_response=None):
+    """Answer the survey with a test client. Return the number of requests"""
+    rnd = random.Random(seed)
+    on_response = on_response or (lambda response: None)
+    url = '/{}/'.format(lang)
+    requests = 0
+    while '/finish/' not in url:
+        page = client.get(url)
+        on_response(page)
+        match = CSRF_RE.search(page.get_data(as_text=True))
+        number = url.rstrip('/').rsplit('/', 1)[-1]
+        number = 'index' if number == lang else number
+        data = dict(form_data(rnd, number),
+                    csrf_token=match.group(1) if match else '')
+        response = client.post(url, data=data)
+        on_response(response)
+        requests += 2
+        if response.status_code != 302:
+            raise RuntimeError('Survey walk stopped at {}'.format(url))
+        url = urlparse(response.headers['Location']).path
+    on_response(client.get(url))
+    return requests + 1
+
+
+@BenchCommand.option('-n', '--respondents', dest='respondents', type=int,
+                     default=20, help='simulated respondents per backend')
+def sessions(respondents):
+    """Cookie bytes per request for each session backend"""
+    from .session import ServerSessionInterface, MemorySessionStore
+    from .session import FileSystemSessionStore, DatabaseSessionStore
+    db.create_all()
+    app = client_app()
+    directory = tempfile.mkdtemp()
+    backends = [
+        ('cookie', app.session_interface),
+        ('memory', ServerSessionInterface(MemorySessionStore())),
+        ('filesystem', ServerSessionInterface(
+            FileSystemSessionStore(directory))),
+        ('database', ServerSessionInterface(DatabaseSessionStore())),
+    ]
+    name = app.config['SESSION_COOKIE_NAME']
+    for backend, interface in backends:
+        app.session_interface = interface
+        sent, received, durations = [], [], []
+        for seed in range(respondents):
+            client = app.test_client()
+
+            def on_response(response):
+                """Collect cookie sizes"""
+                received.append(sum(
+                    len(header)
+                    for header in response.headers.getlist('Set-Cookie')
+                ))
+                sent.append(sum(
+                    len(cookie.value) for cookie in client.cookie_jar
+                    if cookie.name == name
+                ))
+
+            start = time.perf_counter()
+            count = walk_survey(client, seed=seed, on_response=on_response)
+            durations.append((time.perf_counter() - start) * 1000 / count)
+        print('{:<12} request cookie avg={:7.1f}B max={:5d}B '
+              'set-cookie avg={:7.1f}B max={:5d}B'.format(
+                  backend, sum(sent) / len(sent), max(sent),
+                  sum(received) / len(received), max(received)))
+        report(backend + ' per request', durations)
+    app.session_interface = backends[0][1]
+    shutil.rmtree(directory)
+
+
+@BenchCommand.option('-n', '--requests', dest='requests', type=int,
+                     default=1000, help='renders per measurement')
+def navbar(requests):
+    """Navbar rendering time per request with and without the cache"""
+    from .frontend import frontend_top
+    app = client_app()
+    with app.test_request_context('/en/a3/'):
+        session['s_lang'] = 'en'
+        session['s_url'] = 'a3'
+        session['s_minutes'] = '~2 minutes remaining'
+        session['s_index'] = True
+        for number, form_class in survey.FORMS.items():
+            if number == 'a3':
+                break
+            session['s_' + number] = True
+            session['s_{}_a'.format(number)] = synthetic_answer(
+                random.Random(number), form_class)
+        model = app.extensions['navbar']
+
+        def uncached():
+            """Render the navbar from scratch"""
+            model.cache.clear()
+            frontend_top().render()
+
+        report('uncached navbar', timed(uncached, requests))
+        report('cached navbar', timed(
+            lambda: frontend_top().render(), requests))
+        print('cache hits={} misses={}'.format(
+            model.cache.hits, model.cache.misses))
+
+
+@BenchCommand.option('-n', '--respondents', dest='respondents', type=int,
+                     default=20, help='simulated respondents per setting')
+def fragments(respondents):
+    """Question page GET time with and without the form fragment cache"""
+    from .cache import LRUCache
+    db.create_all()
+    app = client_app()
+    cache = app.extensions['fragments']
+    for name, fragment_cache in (('uncached', LRUCache(0)), ('cached', cache)):
+        app.extensions['fragments'] = fragment_cache
+        durations = []
+        for seed in range(respondents):
+            client = app.test_client()
+            get = client.get
+
+            def timed_get(*args, **kwargs):
+                """Record GET duration"""
+                start = time.perf_counter()
+                response = get(*args, **kwargs)
+                durations.append((time.perf_counter() - start) * 1000)
+                return response
+
+            client.get = timed_get
+            walk_survey(client, seed=seed)
+        report(name + ' question GET', durations)
+    print('cache hits={} misses={}'.format(cache.hits, cache.misses))
+
+
+@BenchCommand.option('-n', '--requests', dest='requests', type=int,
+                     default=1000, help='lookups per measurement')
+def catalog(requests):
+    """Startup cost and lookups of the pre-resolved translation catalogs"""
+    from .catalog import current_catalog, local_title
+    db.create_all()
+    app = client_app()
+    print('catalogs resolved at startup in {:.1f}ms'.format(
+        app.extensions['catalogs_startup'] * 1000))
+    catalogs = app.extensions['catalogs']
+    for lang, locale in app.config['LANGUAGES_LOCALE'].items():
+        with app.test_request_context():
+            session['s_lang'] = lang
+
+            def lazy():
+                """Resolve every title and label through gettext"""
+                for number, form_class in survey.FORMS.items():
+                    str(survey.TITLES[number])
+                    for label in form_class.survey_schema().labels.values():
+                        str(label)
+
+            def resolved():
+                """Look every title and label up in the catalog"""
+                catalog = current_catalog()
+                for number, form_class in survey.FORMS.items():
+                    local_title(number, None)
+                    for label in catalog.schemas[form_class].labels.values():
+                        str(label)
+
+            report('gettext strings ' + locale, timed(lazy, requests))
+            report('catalog strings ' + locale, timed(resolved, requests))
+            if Answer.query.first() is None:
+                continue
+            app.extensions['catalogs'] = {}
+            report('gettext csv ' + locale, timed(
+                lambda: create_csv(StringIO(), survey.FORMS, raw=False), 1))
+            app.extensions['catalogs'] = catalogs
+            report('catalog csv ' + locale, timed(
+                lambda: create_csv(StringIO(), survey.FORMS, raw=False), 1))
+
+
+ASSET_RE = re.compile(r'(?:href|src)="(/(?:static|assets)/[^"]+)"')
+
+
+def page_assets(client, url, cache, encoding):
+    """Load url and its local assets like a browser with cache.
+
+    Returns the number of asset requests and body bytes transferred
+    """
+    page = client.get(url)
+    requests, transferred = 0, 0
+    for asset in ASSET_RE.findall(page.get_data(as_text=True)):
+        asset = asset.replace('&amp;', '&')
+        headers = {'Accept-Encoding': encoding}
+        cached = cache.get(asset)
+        if cached is not None:
+            if 'immutable' in cached.headers.get('Cache-Control', ''):
+                continue
+            if cached.headers.get('ETag'):
+                headers['If-None-Match'] = cached.headers['ETag']
+            if cached.headers.get('Last-Modified'):
+                headers['If-Modified-Since'] = cached.headers['Last-Modified']
+        response = client.get(asset, headers=headers)
+        requests += 1
+        transferred += len(response.get_data())
+        if response.status_code == 200:
+            cache[asset] = response
+    return requests, transferred
+
+
+@BenchCommand.option('-n', '--views', dest='views', type=int,
+                     default=5, help='repeat page views')
+def assets(views):
+    """Asset requests and bytes for first and repeat page views"""
+    from .assets import build_assets
+    db.create_all()
+    app = client_app()
+    directory = tempfile.mkdtemp()
+    app.config['ASSET_DIRECTORY'] = directory
+    settings = [('static', {}, 'identity')]
+    with app.app_context():
+        manifest = build_assets(app, directory, minified=True)
+    settings += [
+        ('fingerprinted', manifest, 'identity'),
+        ('fingerprinted', manifest, 'gzip'),
+        ('fingerprinted', manifest, 'br, gzip'),
+    ]
+    for name, manifest, encoding in settings:
+        app.extensions['assets'] = manifest
+        client = app.test_client()
+        cache = {}
+        first = page_assets(client, '/en/', cache, encoding)
+        repeat = [0, 0]
+        for _ in range(views):
+            requests, transferred = page_assets(client, '/en/', cache,
+                                                encoding)
+            repeat[0] += requests
+            repeat[1] += transferred
+        print('{:<14} {:<9} first view {:2d} requests {:8d}B  '
+              'repeat view {:4.1f} requests {:8.1f}B'.format(
+                  name, encoding, first[0], first[1],
+                  repeat[0] / views, repeat[1] / views))
+    shutil.rmtree(directory)
+
+
+@BenchCommand.option('-n', '--requests', dest='requests', type=int,
+                     default=50, help='requests per route and encoding')
+@BenchCommand.option('-r', '--respondents', dest='respondents', type=int,
+                     default=200, help='respondents for the csv dump')
+def compression(requests, respondents):
+    """Bytes and latency per route for each Accept-Encoding"""
+    db.create_all()
+    if Answer.query.first() is None:
+        fill(respondents)
+    app = client_app()
+    app.config['MAIL_USERNAME'] = None
+    client = app.test_client()
+    page = client.get('/en/').get_data(as_text=True)
+    match = CSRF_RE.search(page)
+    response = client.post('/en/', data=dict(
+        form_data(random.Random(0), 'index'),
+        csrf_token=match.group(1) if match else ''))
+    question = urlparse(response.headers['Location']).path
+    routes = ['/en/', question, '/translation/en/', '/send/raw/all/']
+    for route in routes:
+        for encoding in ('identity', 'gzip', 'br'):
+            sizes = []
+
+            def get():
+                """Request route with encoding"""
+                response = client.get(
+                    route, headers={'Accept-Encoding': encoding})
+                sizes.append(len(response.get_data()))
+
+            durations = timed(get, requests)
+            print('{:<16} {:<8} {:9d}B'.format(route, encoding, sizes[-1]))
+            report('{} {}'.format(route, encoding), durations)
+
+
+# Routing decorators replaced by the flow, kept as the baseline of the
+# flow and routes benchmarks
+
+
+def last(order):
+    """Return last visited"""
+    for elements in reversed(order):
+        if not isinstance(elements, tuple):
+            elements = (elements,)
+        for element in elements:
+            number = element.lower()
+            sid = 's_{}'.format(number)
+            if sid in session:
+                return tuple(x.lower() for x in elements)
+    return ('index',)
+
+
+def survey_started(func):
+    """Check if survey has started"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        """Check if survey has started"""
+        if 's_uid' not in session:
+            flash(gettext('Invalid Session. Restarting'))
+            return goto('index')
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def to_tuple(element):
+    if isinstance(element, tuple):
+        return element
+    return (element,)
+
+
+def require(numbers):
+    """Require previous question"""
+    if isinstance(numbers, str):
+        numbers = [numbers]
+    def decorator(func):
+        """Check if survey has started"""
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            """Check if survey has started"""
+            go_back = last(numbers)
+            if to_tuple(numbers[-1]) != go_back:
+                return goto(go_back if go_back != ('index',) else numbers[0])
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def survey_question(numbers, minutes):
+    """Condenses survey_started, require, and set_navbar"""
+    def decorator(func):
+        """Condenses survey_started, require, and set_navbar"""
+        return survey_started(require(numbers)(set_navbar(minutes)(func)))
+    return decorator
+
+
+@BenchCommand.option('-n', '--requests', dest='requests', type=int,
+                     default=2000, help='routing checks per measurement')
+def flow(requests):
+    """Per-request routing overhead of the decorator chain and the flow"""
+    app = client_app()
+    nodes = list(survey.FLOW.nodes.values())
+
+    def legacy_view(node):
+        """Wrap the node guards in the survey_question decorators"""
+        def view():
+            """Evaluate guards"""
+            for edge in node.guards:
+                if edge.when():
+                    return goto(survey.FLOW.follow(edge))
+            return None
+        view.__name__ = node.number
+        requires = node.requires
+        return survey_question(
+            [requires] if isinstance(requires, tuple) else requires,
+            node.minutes)(view)
+
+    legacy = [legacy_view(node) for node in nodes]
+    with app.test_request_context('/en/'):
+        rnd = random.Random(0)
+        session['s_lang'] = 'en'
+        session['s_uid'] = '0' * 48
+        session['s_index'] = True
+        for number, form_class in survey.FORMS.items():
+            session['s_' + number] = True
+            session['s_{}_a'.format(number)] = synthetic_answer(
+                rnd, form_class)
+        # Answers that do not skip questions
+        session['s_t1_a'] = {'python': True, 'r_lang': True}
+        session['s_t2_a'] = {'options': 'python'}
+        for number in ('a1', 'a4', 'c1', 'c2'):
+            session['s_{}_a'.format(number)] = {'options': 'yes'}
+
+        def decorated():
+            """Route every question through the decorator chain"""
+            for view in legacy:
+                view()
+
+        def compiled():
+            """Route every question through the compiled flow"""
+            for node in nodes:
+                survey.FLOW.enter(node.number)
+
+        report('decorators x{}'.format(len(nodes)), timed(decorated, requests))
+        report('flow x{}'.format(len(nodes)), timed(compiled, requests))
+        report('last(ORDER)', timed(lambda: last(survey.ORDER), requests))
+        report('FLOW.last()', timed(survey.FLOW.last, requests))
+
+
+@BenchCommand.option('-n', '--requests', dest='requests', type=int,
+                     default=500, help='requests per url')
+def routes(requests):
+    """Request throughput of valid and unknown question urls"""
+    db.create_all()
+    app = client_app()
+    client = app.test_client()
+    page = client.get('/en/').get_data(as_text=True)
+    match = CSRF_RE.search(page)
+    client.post('/en/', data=dict(
+        form_data(random.Random(0), 'index'),
+        csrf_token=match.group(1) if match else ''))
+    for url in ('/en/p1/', '/en/zz/', '/en/db/', '/en/FORMS/'):
+        status = []
+        durations = timed(
+            lambda: status.append(client.get(url).status_code), requests)
+        print('{:<12} status={} {:8.0f} requests/s'.format(
+            url, status[-1], len(durations) / sum(durations) * 1000))
+    with app.test_request_context('/en/zz/'):
+        session['s_p1'] = True
+        report('getattr dispatch miss', timed(
+            lambda: hasattr(survey, 'zz') or last(survey.ORDER), requests))
+        report('ROUTES dispatch miss', timed(
+            lambda: survey.ROUTES.get('zz') or survey.FLOW.last(), requests))
+
+
+SPA_CSRF_RE = re.compile(r'data-csrf="([^"]*)"')
+
+
+def walk_spa(client, lang='en', seed=0):
+    """Answer the survey through the single-page mode. Return requests"""
+    rnd = random.Random(seed)
+    page = client.get('/spa/{}/'.format(lang)).get_data(as_text=True)
+    client.get('/translation/{}/'.format(lang))
+    answers = {}
+    for number in survey.FORMS:
+        answers[number] = form_data(rnd, number)
+        answers[number].pop('submit')
+    response = client.post(
+        '/spa/{}/answers/'.format(lang), data=json.dumps({'answers': answers}),
+        content_type='application/json',
+        headers={'X-CSRFToken': SPA_CSRF_RE.search(page).group(1)})
+    if response.status_code != 200:
+        raise RuntimeError(response.get_data(as_text=True))
+    return 3
+
+
+@BenchCommand.option('-n', '--respondents', dest='respondents', type=int,
+                     default=20, help='simulated respondents per mode')
+def spa(respondents):
+    """Requests and time per completed survey, multi-page and single-page"""
+    db.create_all()
+    app = client_app()
+    app.config['SPA_MODE'] = True
+    for name, walk in (('multi-page', walk_survey), ('single-page', walk_spa)):
+        requests, durations = [], []
+        for seed in range(respondents):
+            client = app.test_client()
+            start = time.perf_counter()
+            requests.append(walk(client, seed=seed))
+            durations.append((time.perf_counter() - start) * 1000)
+        print('{:<12} {:5.1f} requests per survey'.format(
+            name, sum(requests) / len(requests)))
+        report(name + ' survey', durations)
+
+
+def ndjson_lines(respondents, seed):
+    """Return NDJSON answer records of synthetic respondents"""
+    rnd = random.Random(seed)
+    start = datetime.datetime(2017, 6, 1)
+    lines = []
+    for index in range(respondents):
+        uid = '{:048x}'.format(rnd.getrandbits(192))
+        for row in synthetic_rows(
+                rnd, uid, start + datetime.timedelta(minutes=index)):
+            if row['field'] == 'country':
+                row['value'] = 'BRA'
+            row['created_at'] = row['created_at'].isoformat()
+            lines.append(json.dumps(row) + '\n')
+    return lines
+
+
+def replay_rows(rows):
+    """Write rows question by question, as the survey forms do"""
+    for (uid, number), fields in groupby(
+            rows, lambda row: (row['uid'], row['question'])):
+        fields = list(fields)
+        write_answer(uid, number, fields[0]['lang'],
+                     {row['field']: row['value'] for row in fields})
+        db.session.commit()
+
+
+@BenchCommand.option('-n', '--respondents', dest='respondents', type=int,
+                     default=2000, help='synthetic respondents per run')
+def ingest(respondents):
+    """Rows per second of the NDJSON ingestion by transaction size"""
+    db.create_all()
+    rnd = random.Random(0)
+    rows = [json.loads(line) for line in ndjson_lines(
+        respondents // 10, seed=rnd.getrandbits(32))]
+    duration = timed(lambda: replay_rows(rows), 1)[0] / 1000
+    print('{:<28} {:9.0f} rows/s ({} rows)'.format(
+        'write_answer per question', len(rows) / duration, len(rows)))
+    for chunk in (100, 1000, 10000):
+        lines = ndjson_lines(respondents, seed=rnd.getrandbits(32))
+        result = ingest_lines(lines, chunk=chunk)
+        print('{:<28} {:9} rows/s ({} rows, {} rejected)'.format(
+            'ingest chunk={}'.format(chunk), result['rows_per_second'],
+            result['written'], result['rejected']))
+    result = ingest_lines(lines, chunk=10000)
+    print('{:<28} {:9} rows/s ({} skipped)'.format(
+        'ingest again', result['rows_per_second'], result['skipped']))
+    print('tally mismatches: {}'.format(len(verify_tallies())))
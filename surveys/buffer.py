@@ -0,0 +1,136 @@
+"""Write-behind buffer for answers"""
+import atexit
+import os
+import queue
+import threading
+import time
+
+from flask import current_app
+
+from .db import db
+
+
+class AnswerBuffer(object):
+    """Commit database writes in batches on a background thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self.size = app.config['ANSWER_BUFFER_SIZE']
+        self.interval = app.config['ANSWER_BUFFER_INTERVAL']
+        self.durability = app.config['ANSWER_BUFFER_DURABILITY']
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        """Start the worker in this process.
+
+        A forked worker process inherits the queue but not the thread, so it
+        gets a fresh queue and thread of its own
+        """
+        if self.pid is not None:
+            self.queue = queue.Queue()
+        self.pid = os.getpid()
+        self.thread = threading.Thread(
+            target=self.run, name='answer-buffer', daemon=True
+        )
+        self.thread.start()
+        if self.durability != 'none':
+            atexit.register(self.close)
+
+    def put(self, func, args, wait=False):
+        """Enqueue func(*args). Block until it is committed if wait.
+
+        Starts the worker on first use and after a fork
+        """
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.start()
+        done = threading.Event() if wait else None
+        self.queue.put((func, args, done))
+        if done is not None:
+            done.wait()
+
+    def close(self):
+        """Flush pending writes and stop the worker"""
+        if (self.thread is not None and self.pid == os.getpid()
+                and self.thread.is_alive()):
+            self.queue.put(None)
+            self.thread.join()
+
+    def run(self):
+        """Collect batches up to size or interval and flush them"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.flush(batch)
+                    return
+                batch.append(item)
+            self.flush(batch)
+
+    def flush(self, batch):
+        """Apply a batch in one transaction. Retry one by one on failure"""
+        with self.app.app_context():
+            try:
+                for func, args, _ in batch:
+                    func(*args)
+                db.session.commit()
+            except Exception:  # pylint: disable=broad-except
+                db.session.rollback()
+                self.app.logger.exception(
+                    'Batched answer write failed. Retrying one by one')
+                for func, args, _ in batch:
+                    try:
+                        func(*args)
+                        db.session.commit()
+                    except Exception:  # pylint: disable=broad-except
+                        db.session.rollback()
+                        self.app.logger.exception(
+                            'Lost answer write %s%r', func.__name__, args)
+            finally:
+                for _, _, done in batch:
+                    if done is not None:
+                        done.set()
+
+
+def submit_all(calls, final=False):
+    """Run (func, args) writes in one transaction or hand them to the buffer"""
+    answer_buffer = current_app.extensions.get('answer_buffer')
+    if answer_buffer is None:
+        for func, args in calls:
+            func(*args)
+        db.session.commit()
+        return
+    wait = final and answer_buffer.durability == 'finish'
+    for index, (func, args) in enumerate(calls):
+        answer_buffer.put(func, args, wait=wait and index == len(calls) - 1)
+
+
+def init_answer_buffer(app):
+    """Set up the write-behind buffer if ANSWER_WRITE_BEHIND is set"""
+    if app.config.get('ANSWER_WRITE_BEHIND'):
+        app.extensions['answer_buffer'] = AnswerBuffer(app)
+
+
+def submit(func, args, final=False):
+    """Run a database write now or hand it to the write-behind buffer"""
+    answer_buffer = current_app.extensions.get('answer_buffer')
+    if answer_buffer is None:
+        func(*args)
+        db.session.commit()
+        return
+    wait = final and answer_buffer.durability == 'finish'
+    answer_buffer.put(func, args, wait=wait)
@@ -0,0 +1,46 @@
+"""In-process caches"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """Thread-safe mapping that evicts the least recently used keys"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Return value of key and mark it as recently used"""
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return self.data[key]
+
+    def set(self, key, value):
+        """Store value and evict the oldest keys above maxsize"""
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove key"""
+        with self.lock:
+            return self.data.pop(key, default)
+
+    def clear(self):
+        """Remove all keys"""
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
@@ -0,0 +1,76 @@
+"""Static survey strings translated once per locale at startup"""
+import time
+from collections import OrderedDict, namedtuple
+from types import MappingProxyType
+
+from flask import current_app
+from flask_babel import force_locale, get_locale, get_translations
+
+Catalog = namedtuple('Catalog', [
+    'locale',   # locale name
+    'titles',   # question number -> title
+    'schemas',  # form class -> FormSchema with str labels and choices
+])
+
+
+def localize_schema(schema):
+    """Return schema with labels and choices resolved in the current locale"""
+    return schema._replace(
+        labels=MappingProxyType({
+            field: str(label) for field, label in schema.labels.items()
+        }),
+        choices=MappingProxyType({
+            field: MappingProxyType(OrderedDict(
+                (raw, str(label)) for raw, label in choices.items()
+            ))
+            for field, choices in schema.choices.items()
+        }),
+    )
+
+
+def build_catalog(locale, forms, titles):
+    """Resolve titles and form labels of locale"""
+    with force_locale(locale):
+        get_translations()
+        classes = set(forms.values())
+        classes |= {
+            form_class.survey_schema().dynamic for form_class in forms.values()
+            if form_class.survey_schema().dynamic is not None
+        }
+        return Catalog(
+            locale=locale,
+            titles=MappingProxyType({
+                number: str(title) for number, title in titles.items()
+            }),
+            schemas=MappingProxyType({
+                form_class: localize_schema(form_class.survey_schema())
+                for form_class in classes
+            }),
+        )
+
+
+def init_catalogs(app, forms, titles):
+    """Load the catalogs of LANGUAGES_LOCALE and resolve the static strings"""
+    start = time.perf_counter()
+    with app.test_request_context():
+        catalogs = {
+            locale: build_catalog(locale, forms, titles)
+            for locale in app.config['LANGUAGES_LOCALE'].values()
+        }
+    app.extensions['catalogs'] = MappingProxyType(catalogs)
+    app.extensions['catalogs_startup'] = time.perf_counter() - start
+    app.logger.info('Resolved %d translation catalogs in %.1fms',
+                    len(catalogs), app.extensions['catalogs_startup'] * 1000)
+
+
+def current_catalog():
+    """Return the catalog of the request locale or None"""
+    return current_app.extensions['catalogs'].get(str(get_locale()))
+
+
+def local_title(number, default):
+    """Return the resolved title of question number"""
+    catalog = current_catalog()
+    if catalog is None:
+        return default
+    return catalog.titles.get(number, default)
@@ -0,0 +1,143 @@
+"""Columnar result export (Parquet) for analysis. Requires pyarrow"""
+from collections import namedtuple
+
+from wtforms.fields import BooleanField, RadioField
+
+from .db import summarize, group_questions
+from .helper import respondent_answers
+
+Column = namedtuple('Column', [
+    'name',        # column name
+    'number',      # question number
+    'field',       # answer field
+    'kind',        # 'bool', 'category' or 'text'
+    'categories',  # category values, extended with unknown answers
+    'codes',       # raw answer -> category code
+])
+
+
+def category_column(name, number, field, choices):
+    """Return category column for ordered (raw, label) choices"""
+    categories = [label for _, label in choices]
+    codes = {raw: code for code, (raw, _) in enumerate(choices)}
+    return Column(name, number, field, 'category', categories, codes)
+
+
+def columnar_layout(forms, raw=True):
+    """Return the answer columns of forms.
+
+    CheckForm booleans become one bool column per field. RadioForm options
+    become category codes over the declared choices. Other fields are text
+    """
+    columns = []
+    for number, form_class in forms.items():
+        schema = form_class.survey_schema()
+        for field in schema.fields:
+            name = '{}_{}'.format(number, field)
+            kind = schema.kinds[field]
+            if kind is RadioField:
+                choices = list(schema.choices[field].items())
+                if schema.dynamic is not None:
+                    dynamic = schema.dynamic.survey_schema()
+                    choices += [
+                        (attr, dynamic.labels[attr]) for attr in dynamic.fields
+                        if dynamic.kinds[attr] is BooleanField
+                    ]
+                choices = [
+                    (choice, choice if raw else str(label))
+                    for choice, label in choices
+                ]
+                columns.append(category_column(name, number, field, choices))
+            elif kind is BooleanField and form_class._mode == 'check':
+                columns.append(Column(name, number, field, 'bool', None, None))
+            else:
+                columns.append(Column(name, number, field, 'text', None, None))
+    return columns
+
+
+def column_value(column, answer):
+    """Return the column value of a question answer dict"""
+    if answer is None:
+        return None
+    value = answer.get(column.field)
+    if column.kind == 'bool':
+        return value == 'True'
+    if column.kind == 'text' or value in (None, '', 'None'):
+        return value
+    code = column.codes.get(value)
+    if code is None:
+        code = column.codes[value] = len(column.categories)
+        column.categories.append(value)
+    return code
+
+
+def parquet_schema(columns):
+    """Return the arrow schema of the export"""
+    import pyarrow as pa
+    types = {
+        'bool': pa.bool_(),
+        'category': pa.dictionary(pa.int16(), pa.string()),
+        'text': pa.string(),
+    }
+    return pa.schema(
+        [('uid', pa.string())] +
+        [(column.name, types[column.kind]) for column in columns] +
+        [('first', pa.timestamp('us')), ('last', pa.timestamp('us')),
+         ('time', pa.duration('us')), ('finished', pa.bool_()),
+         ('language', pa.dictionary(pa.int16(), pa.string())),
+         ('origin', pa.dictionary(pa.int16(), pa.string()))]
+    )
+
+
+def record_batch(schema, columns, rows):
+    """Convert a batch of row lists into an arrow table"""
+    import pyarrow as pa
+    arrays = []
+    for index, (values, field) in enumerate(zip(zip(*rows), schema)):
+        column = columns[index - 1] if 0 < index <= len(columns) else None
+        if column is not None and column.kind == 'category':
+            arrays.append(pa.DictionaryArray.from_arrays(
+                pa.array(values, type=pa.int16()),
+                pa.array(column.categories, type=pa.string()),
+            ))
+        elif pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode(
+            ).cast(field.type))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def export_parquet(path, forms, raw=True, batch=10000):
+    """Write results to a Parquet file, one row group per batch.
+
+    Returns the number of respondents
+    """
+    import pyarrow.parquet as pq
+    columns = columnar_layout(forms, raw=raw)
+    schema = parquet_schema(columns)
+    total = 0
+    rows = []
+    with pq.ParquetWriter(path, schema) as writer:
+        for uid, user_answers in respondent_answers():
+            uanswers = {
+                num: {a.field: a.value for a in answers}
+                for num, answers in group_questions(user_answers).items()
+            }
+            summary = summarize(user_answers)
+            rows.append(
+                [uid if isinstance(uid, str) else uid.decode('ascii')] +
+                [column_value(column, uanswers.get(column.number))
+                 for column in columns] +
+                [summary['first'], summary['last'],
+                 summary['last'] - summary['first'], summary['finished'],
+                 summary['language'], summary['origin']]
+            )
+            if len(rows) >= batch:
+                writer.write_table(record_batch(schema, columns, rows))
+                total += len(rows)
+                rows = []
+        if rows:
+            writer.write_table(record_batch(schema, columns, rows))
+            total += len(rows)
+    return total
@@ -0,0 +1,87 @@
+"""gzip and brotli compression of dynamic responses"""
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def accepted_encoding(accept):
+    """Return the preferred supported encoding of an Accept-Encoding"""
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    quality = {encoding: accept[encoding] for encoding in encodings}
+    best = max(encodings, key=lambda encoding: quality[encoding])
+    return best if quality[best] > 0 else None
+
+
+def compressor(encoding, config):
+    """Return (compress, flush) functions of a new stream compressor"""
+    if encoding == 'br':
+        stream = brotli.Compressor(quality=config['COMPRESS_BROTLI_QUALITY'])
+        return stream.process, stream.finish
+    stream = zlib.compressobj(config['COMPRESS_LEVEL'], zlib.DEFLATED, 31)
+    return stream.compress, stream.flush
+
+
+def compress_stream(chunks, encoding, config):
+    """Compress an iterable of bytes as it is consumed"""
+    compress, flush = compressor(encoding, config)
+    try:
+        for chunk in chunks:
+            data = compress(chunk)
+            if data:
+                yield data
+        yield flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def compressible(response, config):
+    """Check if a response may be compressed"""
+    return (
+        200 <= response.status_code < 300 and response.status_code != 204
+        and not response.direct_passthrough
+        and 'Content-Encoding' not in response.headers
+        and response.mimetype in config['COMPRESS_MIMETYPES']
+    )
+
+
+def compress_response(response):
+    """Compress the response body with the encoding the client prefers.
+
+    Buffered bodies below COMPRESS_MIN_SIZE are left alone. Streamed bodies
+    are compressed chunk by chunk. Compressed responses get a weak ETag
+    """
+    config = current_app.config
+    if not compressible(response, config):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(
+            response.iter_encoded(), encoding, config)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        compress, flush = compressor(encoding, config)
+        response.set_data(compress(data) + flush())
+    response.headers['Content-Encoding'] = encoding
+    etag, _ = response.get_etag()
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    """Compress responses after the other after_request handlers"""
+    if app.config['COMPRESS_RESPONSES']:
+        app.after_request_funcs.setdefault(None, []).insert(
+            0, compress_response)
@@ -1,14 +1,72 @@
 """SQLAlchemy database"""
 import datetime
-from sqlalchemy import Column, Integer, String, DateTime
+import json
+from collections import Counter, OrderedDict
+
+from flask import current_app
+from sqlalchemy import Column, Integer, String, DateTime, Float, Text, Index
+from sqlalchemy import Boolean, event
+from sqlalchemy.engine.url import make_url
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 
 
-db = SQLAlchemy()
+def pragma_setter(pragmas):
+    """Return a connect listener that runs SQLite pragmas"""
+    def set_pragmas(dbapi_connection, _):
+        """Run pragmas on a new connection"""
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA {}={}'.format(name, value))
+        cursor.close()
+    return set_pragmas
+
+
+class ProfiledSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy that runs the 'pragmas' engine option on SQLite"""
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop('pragmas', None)
+        engine = super(ProfiledSQLAlchemy, self).create_engine(
+            sa_url, engine_opts)
+        if pragmas and engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', pragma_setter(pragmas))
+        return engine
+
+
+db = ProfiledSQLAlchemy()
 migrate = Migrate()
 
 
+def engine_profile_name(app):
+    """Return the ENGINE_PROFILE of app, resolving 'auto' by database"""
+    name = app.config.get('ENGINE_PROFILE', 'default')
+    if name != 'auto':
+        return name
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    backend = url.get_backend_name()
+    if backend == 'sqlite' and url.database not in (None, '', ':memory:'):
+        return 'sqlite-wal'
+    if backend == 'postgresql':
+        return 'postgres-pooled'
+    return 'default'
+
+
+def init_engine_profile(app):
+    """Merge the engine profile into SQLALCHEMY_ENGINE_OPTIONS.
+
+    Options set in SQLALCHEMY_ENGINE_OPTIONS take precedence. Call it before
+    the engine is created
+    """
+    name = engine_profile_name(app)
+    profiles = app.config.get('ENGINE_PROFILES', {'default': {}})
+    if name not in profiles:
+        raise ValueError('Invalid ENGINE_PROFILE: {}'.format(name))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+        profiles[name], **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.extensions['engine_profile'] = name
+
+
 class Answer(db.Model):
     id = Column(Integer, primary_key=True)
     uid = Column(String(80))
@@ -18,6 +76,12 @@ class Answer(db.Model):
     value = Column(String(120))
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
+    __table_args__ = (
+        Index('ix_answer_uid_question_field', 'uid', 'question', 'field',
+              unique=True),
+        Index('ix_answer_uid_created_at', 'uid', 'created_at'),
+    )
+
     def __init__(self, uid, question, lang, field, value):
         self.uid = uid
         self.question = question
@@ -26,4 +90,316 @@ class Answer(db.Model):
         self.value = value
 
     def __repr__(self):
-        return '<Answer {0.question}.{0.field}={0.value}>'.format(self)
\ No newline at end of file
+        return '<Answer {0.question}.{0.field}={0.value}>'.format(self)
+
+
+class Respondent(db.Model):
+    """Per-respondent summary kept up to date by answer writes"""
+    uid = Column(String(80), primary_key=True)
+    first = Column(DateTime)
+    last = Column(DateTime)
+    finished = Column(Boolean, default=False)
+    language = Column(String(10))
+    # JSON {language: answered questions} that language is derived from
+    languages = Column(Text)
+    origin = Column(String(120))
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow,
+                        index=True)
+
+    def __repr__(self):
+        return '<Respondent {0.uid} {0.first}-{0.last}>'.format(self)
+
+
+class Tally(db.Model):
+    """Incremental answer counter. Empty field and value count respondents"""
+    question = Column(String(10), primary_key=True)
+    field = Column(String(80), primary_key=True)
+    value = Column(String(120), primary_key=True)
+    count = Column(Integer, default=0)
+
+    def __repr__(self):
+        return '<Tally {0.question}.{0.field}={0.value}: {0.count}>'.format(
+            self)
+
+
+class ExportCheckpoint(db.Model):
+    """High-water marks of the last incremental export of a target"""
+    name = Column(String(80), primary_key=True)
+    answer_id = Column(Integer, default=0)
+    updated_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return '<ExportCheckpoint {0.name} {0.answer_id} {0.updated_at}>'.format(
+            self)
+
+
+class JobRecord(db.Model):
+    """Status and log of a background job, shared by all worker processes"""
+    __tablename__ = 'job'
+    id = Column(String(16), primary_key=True)
+    key = Column(String(80))
+    # key while the job is queued or running, so one job per key is active
+    active_key = Column(String(80), unique=True)
+    status = Column(String(10))
+    log = Column(Text)  # json list of lines
+    created_at = Column(DateTime, index=True)
+    updated_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    def __repr__(self):
+        return '<JobRecord {0.key} {0.id} {0.status}>'.format(self)
+
+
+class SessionData(db.Model):
+    __tablename__ = 'session'
+    sid = Column(String(64), primary_key=True)
+    data = Column(Text)
+    expires = Column(Float, index=True)
+
+
+def upsert_insert():
+    """Return the dialect-native insert that supports on_conflict, if any"""
+    if not current_app.config.get('ANSWER_UPSERT', True):
+        return None
+    name = db.engine.dialect.name
+    try:
+        if name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+            return insert
+        if name == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+            return insert
+    except ImportError:
+        pass
+    return None
+
+
+def upsert_answers(rows, stored_ids):
+    """Insert or update answer rows. stored_ids maps existing fields to ids"""
+    insert = upsert_insert()
+    if insert is not None:
+        stmt = insert(Answer.__table__).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['uid', 'question', 'field'],
+            set_={
+                'lang': stmt.excluded.lang,
+                'value': stmt.excluded.value,
+                'created_at': stmt.excluded.created_at,
+            }
+        )
+        db.session.execute(stmt)
+        return
+    updates = [
+        dict(row, id=stored_ids[row['field']])
+        for row in rows if row['field'] in stored_ids
+    ]
+    inserts = [row for row in rows if row['field'] not in stored_ids]
+    if updates:
+        db.session.bulk_update_mappings(Answer, updates)
+    if inserts:
+        db.session.execute(Answer.__table__.insert(), inserts)
+
+
+def write_answer(uid, number, lang, data):
+    """Write only the fields of an answer that changed. Does not commit"""
+    stored, stored_ids, stored_times = {}, {}, {}
+    for id_, field, value, stored_lang, created_at in db.session.query(
+            Answer.id, Answer.field, Answer.value, Answer.lang,
+            Answer.created_at
+    ).filter_by(uid=uid, question=number):
+        stored[field] = (value, stored_lang)
+        stored_ids[field] = id_
+        stored_times[field] = (created_at, stored_lang)
+    values = {key: str(value) for key, value in data.items() if value}
+    now = datetime.datetime.utcnow()
+    changed = [
+        {
+            'uid': uid, 'question': number, 'lang': lang,
+            'field': field, 'value': value, 'created_at': now,
+        }
+        for field, value in values.items()
+        if stored.get(field) != (value, lang)
+    ]
+    removed = [field for field in stored if field not in values]
+    if removed:
+        Answer.query.filter(
+            Answer.uid == uid, Answer.question == number,
+            Answer.field.in_(removed)
+        ).delete(synchronize_session=False)
+    if changed:
+        upsert_answers(changed, stored_ids)
+        kept = [
+            stored_times[field] for field in stored_times
+            if field in values and stored.get(field) == (values[field], lang)
+        ]
+        # Rewritten rows get created_at now, so they leave the old times too
+        rewritten = [row['field'] for row in changed if row['field'] in stored]
+        oldest_removed = min(
+            (stored_times[field][0] for field in removed + rewritten),
+            default=None)
+        touch_respondent(uid, number, values, now, (
+            min(stored_times.values())[1] if stored_times else None,
+            min(kept + [(now, lang)])[1],
+        ), oldest_removed)
+    elif removed:
+        update_respondent(uid)
+    if changed or removed:
+        bump_tallies(tally_deltas(
+            tally_keys(number, {
+                field: value for field, (value, _) in stored.items()
+            }),
+            tally_keys(number, values)
+        ))
+
+
+def delete_answers(uid, numbers):
+    """Delete answers of a list of questions. Does not commit"""
+    stored = {}
+    for question, field, value in db.session.query(
+            Answer.question, Answer.field, Answer.value
+    ).filter(Answer.uid == uid, Answer.question.in_(numbers)):
+        stored.setdefault(question, {})[field] = value
+    if not stored:
+        return
+    removed = set()
+    for question, values in stored.items():
+        removed |= tally_keys(question, values)
+    Answer.query.filter(
+        Answer.uid == uid, Answer.question.in_(numbers)
+    ).delete(synchronize_session=False)
+    update_respondent(uid)
+    bump_tallies(tally_deltas(removed, set()))
+
+
+def group_questions(user_answers):
+    """Return {question: answers} of answers ordered by created_at.
+
+    Fields of a question saved at different times may interleave with other
+    questions, so rows are merged per question instead of grouped in runs
+    """
+    questions = OrderedDict()
+    for answer in user_answers:
+        questions.setdefault(answer.question, []).append(answer)
+    return questions
+
+
+def summarize(user_answers):
+    """Summarize answers of a respondent ordered by created_at"""
+    origin = 'main'
+    finished = False
+    for answer in user_answers:
+        if answer.question == 'finish':
+            finished = True
+        elif answer.question == 'origin' and answer.field == 'submit':
+            origin = answer.value
+    languages = Counter(
+        answers[0].lang for answers in group_questions(user_answers).values()
+    )
+    return {
+        'first': user_answers[0].created_at,
+        'last': user_answers[-1].created_at,
+        'finished': finished,
+        'language': languages.most_common()[0][0],
+        'languages': json.dumps(languages),
+        'origin': origin,
+    }
+
+
+def update_respondent(uid):
+    """Recompute the summary row of a respondent. Does not commit"""
+    user_answers = Answer.query.filter_by(uid=uid).order_by(
+        Answer.created_at, Answer.id
+    ).all()
+    if not user_answers:
+        Respondent.query.filter_by(uid=uid).delete()
+        return
+    db.session.merge(Respondent(
+        uid=uid, updated_at=datetime.datetime.utcnow(),
+        **summarize(user_answers)
+    ))
+
+
+def touch_respondent(uid, number, values, now, languages, removed=None):
+    """Update the summary row of a respondent with an answer saved at now.
+
+    languages is the (old, new) language of the question, old is None if it
+    was not answered. removed is the oldest created_at of deleted or
+    rewritten fields. Does not commit
+    """
+    respondent = Respondent.query.get(uid)
+    if respondent is None:
+        respondent = Respondent(uid=uid, first=now, finished=False,
+                                origin='main', languages='{}')
+        db.session.add(respondent)
+    elif respondent.languages is None or (
+            removed is not None and removed <= respondent.first):
+        # Summary without language counts, or its first answer was replaced
+        update_respondent(uid)
+        return
+    counts = Counter(json.loads(respondent.languages))
+    old, new = languages
+    if old is not None:
+        counts[old] -= 1
+    counts[new] += 1
+    counts = Counter({key: count for key, count in counts.items() if count})
+    respondent.languages = json.dumps(counts)
+    respondent.language = counts.most_common()[0][0]
+    respondent.last = now
+    respondent.updated_at = now
+    if number == 'finish':
+        respondent.finished = True
+    elif number == 'origin' and 'submit' in values:
+        respondent.origin = values['submit']
+
+
+def tally_keys(number, values):
+    """Return counted (question, field, value) keys of an answer.
+
+    Radio options and checked boxes are counted, and every answered
+    question counts once as (question, '', '') for the completion funnel
+    """
+    keys = set()
+    for field, value in values.items():
+        if field == 'options' and value not in ('', 'None'):
+            keys.add((number, field, value))
+        elif value == 'True':
+            keys.add((number, field, value))
+    if values:
+        keys.add((number, '', ''))
+    return keys
+
+
+def tally_deltas(old_keys, new_keys):
+    """Return counter changes from old_keys to new_keys"""
+    deltas = {key: 1 for key in new_keys - old_keys}
+    deltas.update({key: -1 for key in old_keys - new_keys})
+    return deltas
+
+
+def bump_tallies(deltas):
+    """Add deltas to the tally counters. Does not commit"""
+    rows = [
+        {'question': question, 'field': field, 'value': value, 'count': delta}
+        for (question, field, value), delta in deltas.items() if delta
+    ]
+    if not rows:
+        return
+    insert = upsert_insert()
+    table = Tally.__table__
+    if insert is not None:
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['question', 'field', 'value'],
+            set_={'count': table.c.count + stmt.excluded.count}
+        )
+        db.session.execute(stmt)
+        return
+    for row in rows:
+        updated = db.session.execute(table.update().where(
+            (table.c.question == row['question']) &
+            (table.c.field == row['field']) &
+            (table.c.value == row['value'])
+        ).values(count=table.c.count + row['count']))
+        if not updated.rowcount:
+            db.session.execute(table.insert(), row)
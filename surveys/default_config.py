@@ -6,6 +6,9 @@
 #       default, rather the app should fail if it is missing. For the sample
 #       application, one is provided for convenience.
 import os
+
+from sqlalchemy.pool import QueuePool
+
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 def env(value, other=None):
@@ -19,14 +22,142 @@ SQLALCHEMY_DATABASE_URI = env(
     'DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'app.db')
 )
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+# Engine options by profile. 'pragmas' run on each new SQLite connection.
+# ENGINE_PROFILE 'auto' picks sqlite-wal for SQLite files and
+# postgres-pooled for PostgreSQL. SQLALCHEMY_ENGINE_OPTIONS overrides them
+ENGINE_PROFILES = {
+    'default': {},
+    # WAL lets readers run during a write. synchronous=NORMAL only syncs at
+    # checkpoints. Connections are pooled instead of opened per request
+    'sqlite-wal': {
+        'poolclass': QueuePool,
+        'pool_size': 5,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+        'query_cache_size': 1000,
+        'connect_args': {
+            'timeout': 30,
+            'check_same_thread': False,
+            'cached_statements': 256,
+        },
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+        },
+    },
+    'postgres-pooled': {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 30,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+        'query_cache_size': 1000,
+    },
+}
+ENGINE_PROFILE = env('SURVEY_ENGINE_PROFILE', 'auto')
+# Use INSERT ... ON CONFLICT to save answers on SQLite and PostgreSQL.
+# It requires the unique ix_answer_uid_question_field index
+ANSWER_UPSERT = bool(int(env('SURVEY_ANSWER_UPSERT', 1)))
+
+# Write-behind mode: a background thread commits answers in batches of
+# ANSWER_BUFFER_SIZE writes or every ANSWER_BUFFER_INTERVAL seconds.
+# ANSWER_BUFFER_DURABILITY: 'none' drops pending answers on shutdown,
+# 'shutdown' flushes them at exit, 'finish' also waits for final answers
+ANSWER_WRITE_BEHIND = bool(int(env('SURVEY_WRITE_BEHIND', 0)))
+ANSWER_BUFFER_SIZE = int(env('SURVEY_BUFFER_SIZE', 100))
+ANSWER_BUFFER_INTERVAL = float(env('SURVEY_BUFFER_INTERVAL', 1.0))
+ANSWER_BUFFER_DURABILITY = env('SURVEY_BUFFER_DURABILITY', 'shutdown')
+
+# Session storage: 'cookie' keeps the whole session in the signed cookie.
+# 'database', 'filesystem' and 'memory' keep it on the server and only send
+# a signed session id to the browser
+SESSION_BACKEND = env('SURVEY_SESSION_BACKEND', 'cookie')
+SESSION_DIRECTORY = env(
+    'SURVEY_SESSION_DIRECTORY', os.path.join(basedir, 'sessions')
+)
+SESSION_MEMORY_SIZE = int(env('SURVEY_SESSION_MEMORY_SIZE', 10000))
+# Expired server-side sessions are deleted by a save at most once per
+# SESSION_PURGE_INTERVAL seconds (0 disables it) and by `manage.py
+# purge_sessions`
+SESSION_PURGE_INTERVAL = int(env('SURVEY_SESSION_PURGE_INTERVAL', 3600))
+
+# Rendered navbars kept in memory, keyed by language, position and the
+# visited and unanswered questions
+NAVBAR_CACHE_SIZE = int(env('SURVEY_NAVBAR_CACHE_SIZE', 4096))
+
+# Rendered question forms kept in memory, keyed by question, locale and a
+# digest of the prefilled answers
+FRAGMENT_CACHE_SIZE = int(env('SURVEY_FRAGMENT_CACHE_SIZE', 4096))
+
+# Seconds browsers may reuse /translation/<lang>/ before revalidating it.
+# The json is rebuilt when the compiled .mo files change
+TRANSLATION_MAX_AGE = int(env('SURVEY_TRANSLATION_MAX_AGE', 600))
+
+# Single-page survey at /spa/<lang>/: questions are rendered from
+# /translation/<lang>/ in the browser and all answers are saved with one
+# request. / and /scipy redirect to it
+SPA_MODE = bool(int(env('SURVEY_SPA_MODE', 0)))
+
+# Bulk ingestion of answers collected offline: POST /ingest/ with
+# "Authorization: Bearer <INGEST_TOKEN>" and NDJSON records. The endpoint is
+# disabled without a token. Records are written in transactions of
+# INGEST_CHUNK rows
+INGEST_TOKEN = env('SURVEY_INGEST_TOKEN')
+INGEST_CHUNK = int(env('SURVEY_INGEST_CHUNK', 5000))
+
+# Compress html, json and csv responses of at least COMPRESS_MIN_SIZE bytes
+# with brotli (if installed) or gzip, depending on Accept-Encoding. Streamed
+# responses are always compressed
+COMPRESS_RESPONSES = bool(int(env('SURVEY_COMPRESS', 1)))
+COMPRESS_MIN_SIZE = int(env('SURVEY_COMPRESS_MIN_SIZE', 500))
+COMPRESS_LEVEL = int(env('SURVEY_COMPRESS_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(env('SURVEY_COMPRESS_BROTLI_QUALITY', 5))
+COMPRESS_MIMETYPES = env(
+    'SURVEY_COMPRESS_MIMETYPES',
+    'text/html text/plain text/csv application/json'
+).split()
+
+# Result exports are compressed with EXPORT_COMPRESSION ('gzip', 'zip' or
+# 'csv') and kept in memory up to EXPORT_SPOOL bytes before spilling to disk
+EXPORT_COMPRESSION = env('SURVEY_EXPORT_COMPRESSION', 'gzip')
+EXPORT_SPOOL = int(env('SURVEY_EXPORT_SPOOL', 1024 * 1024))
+
+# Fingerprinted static files written by `manage.py assets build`. They are
+# served from /assets/ with a one year immutable Cache-Control
+ASSET_DIRECTORY = env('SURVEY_ASSET_DIRECTORY', os.path.join(basedir, 'build'))
+# Source of `manage.py assets vendor`
+SELECT2_URL = env(
+    'SURVEY_SELECT2_URL',
+    'https://cdnjs.cloudflare.com/ajax/libs/select2/{version}/{path}'
+)
 
 MAIL_SERVER = env('EMAIL_SERVER', 'smtp.gmail.com')
 MAIL_PORT = int(env('EMAIL_PORT', 465)) # 587?
 MAIL_USE_SSL = bool(int(env('EMAIL_USE_SSL', 1)))
 MAIL_USERNAME = env('EMAIL_USERNAME')
 MAIL_PASSWORD = env('EMAIL_PASSWORD')
+# Outbox: retry failed sends with exponential backoff and keep the SMTP
+# connection open while messages arrive within MAIL_OUTBOX_IDLE seconds
+MAIL_RETRIES = int(env('EMAIL_RETRIES', 3))
+MAIL_RETRY_BACKOFF = float(env('EMAIL_RETRY_BACKOFF', 2.0))
+MAIL_OUTBOX_IDLE = float(env('EMAIL_OUTBOX_IDLE', 5.0))
+# Messages that fail every retry are kept here. List and resend them with
+# `manage.py mail_failures [--resend]`
+MAIL_DEAD_LETTERS = env(
+    'EMAIL_DEAD_LETTERS', os.path.join(basedir, 'mail_failed')
+)
 
 GITHUB = env('GITHUB', '~/script-analysis')
+# Background jobs are stored in the database so every worker can report
+# them. An active job that has not logged for JOB_TIMEOUT seconds is failed,
+# and the newest JOB_HISTORY jobs are kept
+JOB_TIMEOUT = int(env('SURVEY_JOB_TIMEOUT', 3600))
+JOB_HISTORY = int(env('SURVEY_JOB_HISTORY', 50))
+# Only re-export respondents touched since the last run and merge them into
+# the existing survey_result.csv
+GITHUB_INCREMENTAL = bool(int(env('SURVEY_GITHUB_INCREMENTAL', 0)))
+# Also write survey_result.parquet for the notebook. Requires pyarrow
+GITHUB_PARQUET = bool(int(env('SURVEY_GITHUB_PARQUET', 0)))
 
 gmail = 'gmail.com'
 newcastle = 'newcastle.ac.uk'
@@ -0,0 +1,116 @@
+"""Compressed and incremental result exports"""
+import codecs
+import csv
+import datetime
+import gzip
+import io
+import tempfile
+import zipfile
+
+from sqlalchemy import func
+
+from .db import db, Answer, Respondent, ExportCheckpoint
+from .helper import csv_rows, touched_answers
+
+FORMATS = {
+    'csv': ('result.csv', 'text/csv'),
+    'gzip': ('result.csv.gz', 'application/gzip'),
+    'zip': ('result.zip', 'application/zip'),
+}
+
+
+def write_rows(textfile, forms, sep, internal_sep, raw):
+    """Write csv rows to text file"""
+    writer = csv.writer(textfile, delimiter=sep)
+    writer.writerows(csv_rows(forms, internal_sep=internal_sep, raw=raw))
+    textfile.flush()
+
+
+def export_csv(forms, compression='gzip', sep=';', internal_sep=',',
+               raw=True, spool_size=1024 * 1024):
+    """Export results to a spooled temporary file.
+
+    Rows are compressed as they are produced. The file stays in memory up to
+    spool_size bytes and is rewound before it is returned
+    """
+    if compression not in FORMATS:
+        raise ValueError('Invalid export compression: {}'.format(compression))
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+    if compression == 'zip':
+        with zipfile.ZipFile(spool, 'w', zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(FORMATS['csv'][0], 'w') as member:
+                with io.TextIOWrapper(member, 'utf-8', newline='') as text:
+                    write_rows(text, forms, sep, internal_sep, raw)
+    elif compression == 'gzip':
+        with gzip.GzipFile(FORMATS['csv'][0], 'wb', fileobj=spool) as member:
+            with io.TextIOWrapper(member, 'utf-8', newline='') as text:
+                write_rows(text, forms, sep, internal_sep, raw)
+    else:
+        # SpooledTemporaryFile is not an io.IOBase before Python 3.11
+        write_rows(codecs.getwriter('utf-8')(spool), forms, sep,
+                   internal_sep, raw)
+    spool.seek(0)
+    return spool
+
+
+def touched_uids(checkpoint):
+    """Return sorted uids with answers written after checkpoint"""
+    uids = {
+        uid for uid, in db.session.query(Answer.uid).filter(
+            Answer.id > checkpoint.answer_id
+        ).distinct()
+    }
+    query = db.session.query(Respondent.uid)
+    if checkpoint.updated_at is not None:
+        query = query.filter(Respondent.updated_at > checkpoint.updated_at)
+    uids.update(uid for uid, in query)
+    return sorted(uids)
+
+
+def export_incremental(csvfile, forms, name, sep=';', internal_sep=',',
+                       raw=True):
+    """Write rows of respondents touched since the checkpoint of name.
+
+    Without a checkpoint all respondents are written. The marks are read
+    before the scan, so a write that races the export shows up again in the
+    next one. The new checkpoint is not committed. Returns the number of
+    respondents written
+    """
+    answer_id = db.session.query(func.max(Answer.id)).scalar() or 0
+    updated_at = db.session.query(func.max(Respondent.updated_at)).scalar()
+    checkpoint = ExportCheckpoint.query.get(name)
+    answers = None
+    if checkpoint is not None:
+        answers = touched_answers(touched_uids(checkpoint))
+    writer = csv.writer(csvfile, delimiter=sep)
+    rows = csv_rows(forms, internal_sep=internal_sep, raw=raw, answers=answers)
+    writer.writerow(next(rows))
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    db.session.merge(ExportCheckpoint(
+        name=name, answer_id=answer_id, updated_at=updated_at,
+        created_at=datetime.datetime.utcnow(),
+    ))
+    return count
+
+
+def reset_checkpoint(name):
+    """Forget the checkpoint of name. The next export writes everything"""
+    ExportCheckpoint.query.filter_by(name=name).delete()
+    db.session.commit()
+
+
+def merge_csv(previous, delta, output, sep=';'):
+    """Merge two csv exports by uid. Rows of delta replace previous rows"""
+    reader = csv.reader(delta, delimiter=sep)
+    header = next(reader)
+    rows = {row[0]: row for row in reader}
+    writer = csv.writer(output, delimiter=sep)
+    writer.writerow(header)
+    previous_reader = csv.reader(previous, delimiter=sep)
+    next(previous_reader, None)
+    for row in previous_reader:
+        writer.writerow(rows.pop(row[0], row))
+    writer.writerows(rows.values())
@@ -0,0 +1,150 @@
+"""Declarative survey flow compiled into lookup tables"""
+from collections import OrderedDict, namedtuple
+
+from flask import session, flash
+from flask_babel import gettext
+
+from .helper import erase, goto, visit
+
+# Jump to the last visited question
+LAST = '<last>'
+
+Edge = namedtuple('Edge', [
+    'target',  # question number or LAST
+    'when',    # predicate or None to always follow the edge
+    'erase',   # questions whose answers are removed before following it
+])
+Edge.__new__.__defaults__ = (None, ())
+
+Node = namedtuple('Node', [
+    'number',    # question number
+    'requires',  # question, or tuple of alternatives, visited before this one
+    'minutes',   # remaining minutes shown in the navbar
+    'next',      # successor number or list of edges tried after submission
+    'guards',    # edges tried before showing the question
+    'options',   # function that returns the choices of the question or None
+])
+Node.__new__.__defaults__ = ((), None)
+
+
+def to_edges(next_question):
+    """Return the edges of a Node.next"""
+    if isinstance(next_question, str):
+        return (Edge(next_question),)
+    return tuple(next_question)
+
+
+class Flow(object):
+    """Survey flow with predecessor, successor and trail tables"""
+
+    def __init__(self, nodes, order):
+        self.nodes = {node.number: node for node in nodes}
+        self.predecessor = {}
+        self.successor = {}
+        for node in nodes:
+            requires = node.requires
+            if isinstance(requires, str):
+                requires = (requires,)
+            keys = () if requires == ('index',) else tuple(
+                's_' + number for number in requires)
+            self.predecessor[node.number] = (keys, requires[-1])
+            edges = to_edges(node.next)
+            if len(edges) == 1 and edges[0].when is None \
+                    and not edges[0].erase and edges[0].target != LAST:
+                self.successor[node.number] = edges[0].target
+            else:
+                self.successor[node.number] = self.follower(edges)
+        # Session keys from the end of the survey to its start
+        self.trail = tuple(
+            ('s_' + number.lower(), (number.lower(),))
+            for number in reversed(order)
+        )
+
+    def last(self):
+        """Return the last visited question of the survey order"""
+        state = session._get_current_object()
+        for key, number in self.trail:
+            if key in state:
+                return number
+        return ('index',)
+
+    def follow(self, edge):
+        """Erase the answers of edge and return its target"""
+        if edge.erase:
+            erase(list(edge.erase))
+        return self.last() if edge.target == LAST else edge.target
+
+    def follower(self, edges):
+        """Return function that follows the first matching edge"""
+        def successor():
+            """Return the next question"""
+            for edge in edges:
+                if edge.when is None or edge.when():
+                    return self.follow(edge)
+            raise ValueError('No edge to follow')
+        return successor
+
+    def check(self, number):
+        """Return the question to show instead of number, or None.
+
+        Redirects if the survey has not started, the required question was
+        not visited or a guard skips number. Otherwise marks number as
+        visited
+        """
+        state = session._get_current_object()
+        if 's_uid' not in state:
+            flash(gettext('Invalid Session. Restarting'))
+            return 'index'
+        keys, target = self.predecessor[number]
+        if keys and not any(key in state for key in keys):
+            return target
+        node = self.nodes[number]
+        visit(number, node.minutes)
+        for edge in node.guards:
+            if edge.when():
+                return self.follow(edge)
+        return None
+
+    def enter(self, number):
+        """Return a redirect if number must not be shown, or None"""
+        target = self.check(number)
+        return goto(target) if target is not None else None
+
+    def view(self, number, render):
+        """Return view of number.
+
+        render(number, next_question, options) processes the question form
+        """
+        node = self.nodes[number]
+        successor = self.successor[number]
+
+        def question():
+            """Process question"""
+            response = self.enter(number)
+            if response is not None:
+                return response
+            options = node.options() if node.options is not None else None
+            return render(number, successor, options)
+        question.__name__ = number
+        return question
+
+    def views(self, render):
+        """Return the views of all questions"""
+        return {number: self.view(number, render) for number in self.nodes}
+
+    def as_dict(self):
+        """Return the flow with predicate names, for clients"""
+        def edges(items):
+            """Serialize edges"""
+            return [{
+                'target': edge.target,
+                'when': edge.when.__name__ if edge.when else None,
+                'erase': list(edge.erase),
+            } for edge in items]
+        return OrderedDict((number, {
+            'requires': [key[2:] for key in self.predecessor[number][0]],
+            'minutes': node.minutes,
+            'next': edges(to_edges(node.next)),
+            'guards': edges(node.guards),
+            'options': node.options.__name__ if node.options else None,
+        }) for number, node in self.nodes.items())
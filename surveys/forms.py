@@ -1,8 +1,11 @@
 # pylint: disable=line-too-long
 """Survey Forms"""
-from collections import OrderedDict
+import gettext as gettext_module
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from types import MappingProxyType
 
-from flask_babel import lazy_gettext, gettext
+from flask_babel import lazy_gettext, gettext, get_locale
 
 from wtforms.fields import SubmitField, TextField, BooleanField
 from wtforms.fields import RadioField, SelectField, TextAreaField
@@ -13,40 +16,101 @@ from flask_wtf import FlaskForm
 
 import pycountry
 
+FormSchema = namedtuple('FormSchema', [
+    'fields',          # survey fields defined in the class, in order
+    'unbound_fields',  # survey fields in WTForms order
+    'kinds',           # field -> field class
+    'labels',          # field -> label
+    'choices',         # field -> {raw choice: label}
+    'specify',         # "_e" field -> specify text field
+    'dynamic',         # _dynamic_checkform or None
+])
+
+_SCHEMAS = {}
+
+
+def build_schema(form_class):
+    """Reflect a form class into a FormSchema"""
+    def survey_field(value):
+        """Check if value is a non-submit unbound field"""
+        return (isinstance(value, UnboundField) and
+                value.field_class is not SubmitField)
+    fields = tuple(attr for attr, value in form_class.__dict__.items()
+                   if survey_field(value))
+    unbound = sorted(
+        ((attr, getattr(form_class, attr)) for attr in dir(form_class)
+         if not attr.startswith('_')
+         if survey_field(getattr(form_class, attr))),
+        key=lambda item: (item[1].creation_counter, item[0])
+    )
+    unbound = OrderedDict(unbound)
+    return FormSchema(
+        fields=fields,
+        unbound_fields=tuple(unbound),
+        kinds=MappingProxyType({
+            attr: value.field_class for attr, value in unbound.items()
+        }),
+        labels=MappingProxyType({
+            attr: value.args[0] if value.args else ''
+            for attr, value in unbound.items()
+        }),
+        choices=MappingProxyType({
+            attr: MappingProxyType(OrderedDict(value.kwargs['choices']))
+            for attr, value in unbound.items()
+            if value.kwargs.get('choices') is not None
+        }),
+        specify=MappingProxyType({
+            attr: attr[:-2] for attr in unbound
+            if attr.endswith('_e') and attr[:-2] in unbound
+        }),
+        dynamic=getattr(form_class, '_dynamic_checkform', None),
+    )
+
+
 class Form(FlaskForm):
     """Survey Form BaseClass"""
 
+    @classmethod
+    def survey_schema(cls):
+        """Return cached FormSchema"""
+        schema = _SCHEMAS.get(cls)
+        if schema is None:
+            schema = _SCHEMAS[cls] = build_schema(cls)
+        return schema
+
     @classmethod
     def survey_fields(cls):
         """Return form fields"""
-        return [attr for attr, value in cls.__dict__.items()
-                if isinstance(value, UnboundField)
-                if value.field_class is not SubmitField]
+        return list(cls.survey_schema().fields)
 
     @classmethod
     def survey_unbound_fields(cls):
         """Return form fields"""
-        return [attr
-                for attr, value in cls._unbound_fields or cls.__dict__.items()
-                if isinstance(value, UnboundField)
-                if value.field_class is not SubmitField]
+        return list(cls.survey_schema().unbound_fields)
 
     @classmethod
-    def survey_field_answer(cls, field, answer, raw=False):  # pylint: disable=unused-argument
+    def survey_field_answer(cls, field, answer, raw=False, catalog=None):  # pylint: disable=unused-argument
         """Return field answer as str"""
         if field not in answer:
             return None
         return str(answer[field])
 
+    @classmethod
+    def survey_local_schema(cls, catalog=None):
+        """Return FormSchema with labels resolved by catalog, if any"""
+        if catalog is not None and cls in catalog.schemas:
+            return catalog.schemas[cls]
+        return cls.survey_schema()
 
     @classmethod
-    def survey_answers(cls, answer, raw=False, sep=', '):
+    def survey_answers(cls, answer, raw=False, sep=', ', catalog=None):
         """Return field answers for a user"""
         if answer is None:
             return ''
         result = []
-        for field in cls.survey_fields():
-            ans = cls.survey_field_answer(field, answer, raw=raw)
+        for field in cls.survey_schema().fields:
+            ans = cls.survey_field_answer(field, answer, raw=raw,
+                                          catalog=catalog)
             if ans is not None:
                 result.append(ans)
         return sep.join(result)
@@ -57,9 +121,9 @@ class RadioForm(Form):
     _mode = 'radio'
 
     @classmethod
-    def survey_field_answer(cls, field, answer, raw=False):
-        unbound = getattr(cls, field)
-        if answer.get(field, '') in ('', 'None') or unbound.field_class is not RadioField:
+    def survey_field_answer(cls, field, answer, raw=False, catalog=None):
+        schema = cls.survey_local_schema(catalog)
+        if answer.get(field, '') in ('', 'None') or schema.kinds[field] is not RadioField:
             return None
         extra = ''
         raw_name = str(answer[field])
@@ -68,13 +132,13 @@ class RadioForm(Form):
         if raw:
             return raw_name + extra
         try:
-            name = str(dict(unbound.kwargs['choices'])[raw_name])
+            name = str(schema.choices[field][raw_name])
             return name + extra
         except KeyError:
-            if not hasattr(cls, '_dynamic_checkform'):
+            if schema.dynamic is None:
                 raise
-            return cls._dynamic_checkform.survey_field_answer(
-                raw_name, {raw_name: 'True'}, raw=raw
+            return schema.dynamic.survey_field_answer(
+                raw_name, {raw_name: 'True'}, raw=raw, catalog=catalog
             )
 
 
@@ -84,17 +148,17 @@ class CheckForm(Form):
     _mode = 'check'
 
     @classmethod
-    def survey_field_answer(cls, field, answer, raw=False):
-        unbound = getattr(cls, field)
-        is_not_boolean = unbound.field_class is not BooleanField
+    def survey_field_answer(cls, field, answer, raw=False, catalog=None):
+        schema = cls.survey_local_schema(catalog)
+        is_not_boolean = schema.kinds[field] is not BooleanField
         if answer.get(field, '') != 'True' or is_not_boolean:
             return None
         extra = ''
-        if field.endswith('_e') and field[:-2] in answer:
-            extra = '({})'.format(answer[field[:-2]])
+        if field in schema.specify and schema.specify[field] in answer:
+            extra = '({})'.format(answer[schema.specify[field]])
         if raw:
             return field + extra
-        name = str(unbound.args[0])
+        name = str(schema.labels[field])
         return name + extra
 
 
@@ -187,18 +251,35 @@ class Situations(CheckForm):
     submit = SubmitField(lazy_gettext('Next'))
 
 
+def country_translation(locale):
+    """Return pycountry gettext catalog for locale"""
+    for domain in ('iso3166-1', 'iso3166'):
+        try:
+            return gettext_module.translation(
+                domain, pycountry.LOCALES_DIR, languages=[locale])
+        except (IOError, OSError):
+            pass
+    return gettext_module.NullTranslations()
+
+
+@lru_cache(maxsize=None)
+def country_choices(locale='en'):
+    """Return sorted country choices for locale. Computed once per locale"""
+    translation = country_translation(locale)
+    return tuple(
+        [("", "")] +
+        sorted(
+            [(country.alpha_3, translation.gettext(country.name))
+             for country in pycountry.countries],
+            key=lambda e: e[1]
+        )
+    )
+
+
 class CountrySelectField(SelectField):
     def __init__(self, *args, **kwargs):
         super(CountrySelectField, self).__init__(*args, **kwargs)
-        self.choices = (
-            [("", "")] +
-            sorted(
-                [(country.alpha_3, "{}".format(country.name))
-                 for country in pycountry.countries],
-                key=lambda e: e[1]
-            )
-
-        )
+        self.choices = country_choices(str(get_locale() or 'en'))
 
 class Country(TextForm):
     """Q/P6"""
@@ -1,52 +1,109 @@
 """Navbar and routes"""
-import subprocess
-import traceback
-from io import StringIO
-from os.path import join, expanduser
+import glob
+import hashlib
+import hmac
+import os
+from collections import OrderedDict
 from itertools import groupby
 
-from flask import Blueprint, session, request, current_app, jsonify
-from flask_babel import lazy_gettext
+from flask import Blueprint, Response, session, request, current_app, jsonify
+from flask import stream_with_context, url_for, abort, send_file, json
+from flask import redirect, render_template
+from flask_babel import lazy_gettext, force_locale, get_domain
 from flask_mail import Message
+from flask_wtf.csrf import validate_csrf
 
 from sqlalchemy import select
+from wtforms.fields import BooleanField
+from wtforms.validators import ValidationError
 
 from . import survey
 from .babel import babel
-from .db import db, Answer
-from .helper import local_view, last, goto, answer, create_csv
-from .mail import mail
-from .nav import nav, ExtendedNavbar
+from .db import db, Answer, Tally
+from .github import notebook_pipeline
+from .export import FORMATS, export_csv
+from .helper import local_view, goto, stream_csv, csrf_token, visit
+from .ingest import ingest
+from .jobs import jobs
+from .mail import queue_mail, dead_letters
+from .cache import LRUCache
+from .nav import nav, ExtendedNavbar, CachedNavbar
+from .spa import batch_errors, spa_state, submit_answers
 
 GET_POST = ('GET', 'POST')
 frontend = Blueprint('frontend', __name__)
 
 
-def frontend_top():
-    """Calculate Navbar"""
-    languages = current_app.config['LANGUAGES']
+class NavbarModel(object):
+    """Static parts of the navbar, compiled once per app"""
+
+    def __init__(self, app):
+        self.order = tuple(
+            (element, element.lower(), 's_' + element.lower(),
+             's_{}_a'.format(element.lower()))
+            for element in survey.ORDER
+        )
+        languages = app.config['LANGUAGES']
+        self.languages = {
+            lang: tuple((k, v) for k, v in languages.items() if k != lang)
+            for lang in languages
+        }
+        self.cache = LRUCache(app.config['NAVBAR_CACHE_SIZE'])
+
+
+def init_navbar(app):
+    """Compile the navbar model of app"""
+    app.extensions['navbar'] = NavbarModel(app)
+
+
+def unanswered(ans):
+    """Check if answer was skipped"""
+    if 'options' in ans and ans['options'] == 'None':
+        return True
+    return len(ans) == sum(1 for x in ans.values() if not x)
+
+
+def build_navbar(model, lang, current, minutes, start, visited, skipped):
+    """Build the navbar element"""
     args = []
-    if 's_index' in session:
+    if start:
         args.append(local_view(lazy_gettext('Start2'), 'index'))
-    for element in survey.ORDER:
-        lele = element.lower()
-        if 's_' + lele in session:
+    for element, lele, _, _ in model.order:
+        if lele in visited:
             view = local_view(element, lele)
-            ans = answer(lele)
-            if lele != session['s_url']:
-                if 'options' in ans and ans['options'] == 'None':
-                    view.classes = ['unanswered']
-                elif len(ans) == sum(1 for x in ans.values() if not x):
-                    view.classes = ['unanswered']
+            if lele in skipped:
+                view.classes = ['unanswered']
             args.append(view)
-    language_items = [local_view(v, lang=k) for k, v in languages.items()
-                      if k != session['s_lang']]
+    language_items = [local_view(v, lang=k) for k, v in model.languages[lang]]
 
     return ExtendedNavbar(
-        title=local_view(session['s_minutes']),
+        title=local_view(minutes),
         items=args, right_items=language_items
     )
 
+
+def frontend_top():
+    """Calculate Navbar"""
+    model = current_app.extensions['navbar']
+    lang = session['s_lang']
+    current = session['s_url']
+    visited, skipped = [], []
+    for _, lele, visited_key, answer_key in model.order:
+        if visited_key in session:
+            visited.append(lele)
+            if lele != current and unanswered(session.get(answer_key, {})):
+                skipped.append(lele)
+    # View.active compares each item url with request.path
+    key = (
+        lang, request.script_root, request.path, current,
+        session['s_minutes'], 's_index' in session, tuple(visited),
+        tuple(skipped),
+    )
+    return CachedNavbar(model.cache, key, lambda: build_navbar(
+        model, lang, current, session['s_minutes'], 's_index' in session,
+        frozenset(visited), frozenset(skipped)
+    ))
+
 nav.register_element('frontend_top', frontend_top)
 
 @babel.localeselector
@@ -59,17 +116,24 @@ def get_locale():
     return request.accept_languages.best_match(locale.values())
 
 
+def start():
+    """Redirect to the first page of the survey"""
+    if current_app.config['SPA_MODE']:
+        return redirect(url_for('.spa', lang=session.get('s_lang', 'en')))
+    return goto('index')
+
+
 @frontend.route('/')
 def root():
     """Redirect to ptbr"""
-    return goto('index')
+    return start()
 
 @frontend.route('/scipy')
 def scipy():
     """Redirect to en"""
     session['s_origin'] = 'scipy'
     session['s_lang'] = 'en'
-    return goto('index')
+    return start()
 
 @frontend.route('/clear')
 def clear():
@@ -89,70 +153,66 @@ def send(lang, receiver):
     else:
         session['s_lang'] = lang
 
-    csvfile = StringIO()
-    create_csv(csvfile, survey.FORMS, sep=',', internal_sep=';', raw=raw)
-    csvfile.seek(0)
-
     if receiver == "github":
-        try:
-            import nbformat
-            from nbconvert.preprocessors import ExecutePreprocessor
-
-            output = []
-            github_path = expanduser(current_app.config["GITHUB"])
-            csv_path = join(github_path, "..", "survey_result.csv")
-            with open(csv_path, "w") as csv:
-                csv.write(csvfile.read())
-            output.append("Wrote survey_result.csv")
-
-            output.append("Pulling GitHub repository")
-            pull = subprocess.check_output(["git", "pull"], cwd=github_path)
-            output.append(pull.decode("utf-8"))
-            output.append("Converting notebook to html")
-            survey_analysis_path = join(github_path, "survey_analysis")
-            with open(join(survey_analysis_path, "Analysis.ipynb")) as f:
-                nb = nbformat.read(f, 4)
-            ep = ExecutePreprocessor()
-            ep.preprocess(nb, {'metadata': {'path': survey_analysis_path}})
-            with open(join(survey_analysis_path, 'Automatic.ipynb'), 'wt') as f:
-                nbformat.write(nb, f)
-
-            '''
-            nbconvert = subprocess.check_output([
-                "jupyter", "nbconvert",
-                "--to", "notebook",
-                "--output", "Automatic.ipynb",
-                "--execute",
-                "Analysis.ipynb"
-            ], cwd=survey_analysis_path)
-
-            output.append(nbconvert.decode("utf-8"))
-            '''
-            output.append("Commiting changes")
-            commit = subprocess.check_output([
-                "git", "commit", "-am", "Automatic generation"], cwd=github_path)
-            output.append(commit.decode("utf-8"))
-            output.append("Pushing GitHub repository")
-            pull = subprocess.check_output(["git", "push"], cwd=github_path)
-
-            return "<br>".join(output)
-        except:
-            return traceback.format_exc().replace("\n", "<br>")
+        job = jobs.submit(
+            'github', notebook_pipeline,
+            current_app._get_current_object(), lang
+        )
+        return jsonify(dict(
+            job.as_dict(), url=url_for('.job_status', job_id=job.id)
+        ))
+
+    download = request.args.get('download')
+    if download is not None:
+        compression = download or current_app.config['EXPORT_COMPRESSION']
+        if compression not in FORMATS:
+            abort(404)
+        filename, mimetype = FORMATS[compression]
+        return send_file(
+            export_csv(survey.FORMS, compression, sep=',', internal_sep=';',
+                       raw=raw, spool_size=current_app.config['EXPORT_SPOOL']),
+            mimetype=mimetype, as_attachment=True,
+            attachment_filename=filename
+        )
 
     if current_app.config['MAIL_USERNAME'] is None:
-        return '<br>'.join(csvfile.readlines())
-
-    if receiver not in current_app.config['CONTACTS']:
+        lines = stream_csv(survey.FORMS, sep=',', internal_sep=';', raw=raw)
+        return Response(stream_with_context(
+            line if index == 0 else '<br>' + line
+            for index, line in enumerate(lines)
+        ))
+
+    contacts = current_app.config['CONTACTS']
+    receivers = list(contacts) if receiver == 'all' else receiver.split(',')
+    if not all(name in contacts for name in receivers):
         return 'Invalid receiver'
 
-    recipient = '@'.join(current_app.config['CONTACTS'][receiver])
+    recipients = ['@'.join(contacts[name]) for name in receivers]
     msg = Message('Survey Results',
                   sender=current_app.config['MAIL_USERNAME'],
-                  recipients=[recipient])
+                  recipients=recipients)
     msg.body = 'Find the survey results attached'
-    msg.attach('result.csv', 'text/csv', csvfile.read())
-    mail.send(msg)
-    return 'Email sent to {}'.format(recipient)
+    compression = current_app.config['EXPORT_COMPRESSION']
+    filename, mimetype = FORMATS[compression]
+    with export_csv(survey.FORMS, compression, sep=',', internal_sep=';',
+                    raw=raw,
+                    spool_size=current_app.config['EXPORT_SPOOL']) as result:
+        msg.attach(filename, mimetype, result.read())
+    queue_mail(msg)
+    result = 'Email queued to {}'.format(', '.join(recipients))
+    failures = len(dead_letters(current_app))
+    if failures:
+        result += '. {} earlier messages were not delivered'.format(failures)
+    return result
+
+
+@frontend.route('/jobs/<job_id>/')
+def job_status(job_id):
+    """Status and log of a background job"""
+    job = jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.as_dict())
 
 
 @frontend.route('/<lang>/', defaults={'number': 'index'}, methods=GET_POST)
@@ -161,18 +221,14 @@ def question(lang, number):
     """Survey question routes"""
     languages = current_app.config['LANGUAGES']
     session['s_lang'] = lang if lang in languages else 'en'
-    if hasattr(survey, number):
-        return getattr(survey, number)()
-    return goto(last(survey.ORDER))
+    view = survey.ROUTES.get(number)
+    if view is not None:
+        return view()
+    return goto(survey.FLOW.last())
 
 
-@frontend.route('/translation/<lang>/')
-def translation(lang):
-    """Create json with translations"""
-    from collections import OrderedDict
-    languages = current_app.config['LANGUAGES']
-    session['s_lang'] = lang if lang in languages else 'en'
-
+def translation_catalog():
+    """Create translations of the current locale"""
     result = OrderedDict()
     result["_order"] = []
     for qnum, form in survey.FORMS.items():
@@ -183,10 +239,10 @@ def translation(lang):
         result[qnum]['answers'] = OrderedDict()
         result[qnum]['answer_order'] = []
         fields_e = []
-        for field in form.survey_unbound_fields():
-            field_obj = getattr(form, field)
+        schema = form.survey_schema()
+        for field in schema.unbound_fields:
             if field == 'options':
-                for raw, ans in field_obj.kwargs['choices']:
+                for raw, ans in schema.choices[field].items():
                     result[qnum]['answer_order'].append(raw)
                     result[qnum]['answers'][raw] = str(ans)
             else:
@@ -194,11 +250,158 @@ def translation(lang):
                     fields_e.append(field)
                 else:
                     result[qnum]['answer_order'].append(field)
-                result[qnum]['answers'][field] = str(field_obj.args[0])
+                result[qnum]['answers'][field] = str(schema.labels[field])
 
         for field_e in fields_e:
             field = field_e[:-2]
             result[qnum]['answers'][field] = result[qnum]['answers'][field_e]
             del result[qnum]['answers'][field_e]
 
-    return jsonify(result)
+    return result
+
+
+def translation_signature(locale):
+    """Return path, mtime and size of the compiled catalogs of locale"""
+    signature = []
+    for directory in babel.translation_directories:
+        pattern = os.path.join(directory, locale, 'LC_MESSAGES', '*.mo')
+        for path in sorted(glob.glob(pattern)):
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def init_translations(app):
+    """Create the translation json cache"""
+    app.extensions['translations'] = LRUCache(len(app.config['LANGUAGES']))
+
+
+@frontend.route('/translation/<lang>/')
+def translation(lang):
+    """Create json with translations"""
+    languages = current_app.config['LANGUAGES']
+    lang = lang if lang in languages else 'en'
+    locale = current_app.config['LANGUAGES_LOCALE'][lang]
+    cache = current_app.extensions['translations']
+    signature = translation_signature(locale)
+    cached = cache.get(lang)
+    if cached is None or cached[0] != signature:
+        if cached is not None:
+            get_domain().cache.clear()
+        with force_locale(locale):
+            body = json.dumps(translation_catalog()).encode('utf-8')
+        cached = (signature, body, hashlib.sha1(body).hexdigest())
+        cache.set(lang, cached)
+    response = current_app.response_class(
+        cached[1], mimetype='application/json'
+    )
+    response.set_etag(cached[2])
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['TRANSLATION_MAX_AGE']
+    return response.make_conditional(request)
+
+
+@frontend.route('/spa/<lang>/')
+def spa(lang):
+    """Single-page survey"""
+    if not current_app.config['SPA_MODE']:
+        abort(404)
+    languages = current_app.config['LANGUAGES']
+    session['s_lang'] = lang = lang if lang in languages else 'en'
+    visit('index', 6)
+    return render_template('spa.html', spa=spa_state(lang), csrf=csrf_token())
+
+
+@frontend.route('/spa/<lang>/answers/', methods=['POST'])
+def spa_answers(lang):
+    """Save the answers of a single-page survey in one request"""
+    if not current_app.config['SPA_MODE']:
+        abort(404)
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken'))
+        except ValidationError as error:
+            return jsonify(errors={'csrf_token': [error.args[0]]}), 400
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(
+            data.get('answers'), dict):
+        abort(400)
+    errors = batch_errors(data['answers'])
+    if errors is not None:
+        return jsonify(errors), 400
+    languages = current_app.config['LANGUAGES']
+    session['s_lang'] = lang if lang in languages else 'en'
+    result, status = submit_answers(data['answers'])
+    return jsonify(result), status
+
+
+@frontend.route('/ingest/', methods=['POST'])
+def ingest_answers():
+    """Write NDJSON answer records collected offline"""
+    token = current_app.config['INGEST_TOKEN']
+    if not token:
+        abort(404)
+    authorization = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(authorization.encode('utf-8'),
+                               'Bearer {}'.format(token).encode('utf-8')):
+        abort(401)
+    result = ingest(request.stream)
+    valid = result['written'] + result['skipped']
+    return jsonify(result), 400 if result['rejected'] and not valid else 200
+
+
+def stats_result():
+    """Return answer counts and the completion funnel in the current locale"""
+    counts = {}
+    for tally in Tally.query:
+        counts.setdefault(tally.question, {})[
+            (tally.field, tally.value)] = tally.count
+
+    result = OrderedDict()
+    result['funnel'] = OrderedDict(
+        (number, counts.get(number, {}).get(('', ''), 0))
+        for number in ['index'] + [x.lower() for x in survey.ORDER]
+    )
+    for qnum, form in survey.FORMS.items():
+        if form._mode not in ('radio', 'check'):
+            continue
+        schema = form.survey_schema()
+        qcounts = counts.get(qnum, {})
+        answers = OrderedDict()
+        if form._mode == 'radio':
+            keys = list(schema.choices['options'])
+            keys += sorted(
+                value for field, value in qcounts
+                if field == 'options' and value not in keys
+            )
+            for raw in keys:
+                label = schema.choices['options'].get(raw)
+                if label is None and schema.dynamic is not None:
+                    label = schema.dynamic.survey_schema().labels.get(raw)
+                answers[raw] = {
+                    'label': str(label if label is not None else raw),
+                    'count': qcounts.get(('options', raw), 0),
+                }
+        else:
+            for field in schema.fields:
+                if schema.kinds[field] is BooleanField:
+                    answers[field] = {
+                        'label': str(schema.labels[field]),
+                        'count': qcounts.get((field, 'True'), 0),
+                    }
+        result[qnum] = OrderedDict([
+            ('title', str(survey.TITLES[qnum])),
+            ('respondents', qcounts.get(('', ''), 0)),
+            ('answers', answers),
+        ])
+
+    return result
+
+
+@frontend.route('/stats/<lang>/')
+def stats(lang):
+    """Create json with answer counts and the completion funnel"""
+    languages = current_app.config['LANGUAGES']
+    lang = lang if lang in languages else 'en'
+    with force_locale(current_app.config['LANGUAGES_LOCALE'][lang]):
+        return jsonify(stats_result())
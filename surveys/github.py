@@ -0,0 +1,80 @@
+"""Update the GitHub analysis repository with the survey results"""
+import os
+import subprocess
+from os.path import join, expanduser
+
+from flask_babel import force_locale
+
+from . import survey
+from .db import db
+from .export import export_incremental, reset_checkpoint, merge_csv
+from .helper import create_csv
+
+
+def run(job, command, cwd):
+    """Run command and write its output to the job log"""
+    output = subprocess.check_output(command, cwd=cwd,
+                                     stderr=subprocess.STDOUT)
+    job.write(output.decode('utf-8'))
+
+
+def update_csv(job, csv_path, checkpoint, raw):
+    """Merge respondents touched since the last run into the csv"""
+    if not os.path.exists(csv_path):
+        reset_checkpoint(checkpoint)
+    delta_path = csv_path + ".delta"
+    with open(delta_path, "w") as delta:
+        count = export_incremental(delta, survey.FORMS, checkpoint,
+                                   sep=',', internal_sep=';', raw=raw)
+    if os.path.exists(csv_path):
+        merged_path = csv_path + ".merged"
+        with open(csv_path) as previous, open(delta_path) as delta, \
+                open(merged_path, "w") as output:
+            merge_csv(previous, delta, output, sep=',')
+        os.replace(merged_path, csv_path)
+        os.remove(delta_path)
+    else:
+        os.replace(delta_path, csv_path)
+    db.session.commit()
+    job.write("Wrote {} respondents to survey_result.csv".format(count))
+
+
+def notebook_pipeline(job, app, lang):
+    """Write results, run Analysis.ipynb, commit and push"""
+    import nbformat
+    from nbconvert.preprocessors import ExecutePreprocessor
+
+    raw = lang not in app.config['LANGUAGES']
+    locale = app.config['LANGUAGES_LOCALE'].get(lang, 'en')
+    with app.app_context(), force_locale(locale):
+        github_path = expanduser(app.config["GITHUB"])
+        csv_path = join(github_path, "..", "survey_result.csv")
+        if app.config['GITHUB_INCREMENTAL']:
+            update_csv(job, csv_path, 'github-' + lang, raw)
+        else:
+            with open(csv_path, "w") as csvfile:
+                create_csv(csvfile, survey.FORMS,
+                           sep=',', internal_sep=';', raw=raw)
+            job.write("Wrote survey_result.csv")
+        if app.config['GITHUB_PARQUET']:
+            from .columnar import export_parquet
+            export_parquet(join(github_path, "..", "survey_result.parquet"),
+                           survey.FORMS, raw=raw)
+            job.write("Wrote survey_result.parquet")
+
+    job.write("Pulling GitHub repository")
+    run(job, ["git", "pull"], github_path)
+
+    job.write("Converting notebook to html")
+    survey_analysis_path = join(github_path, "survey_analysis")
+    with open(join(survey_analysis_path, "Analysis.ipynb")) as f:
+        nb = nbformat.read(f, 4)
+    ep = ExecutePreprocessor()
+    ep.preprocess(nb, {'metadata': {'path': survey_analysis_path}})
+    with open(join(survey_analysis_path, 'Automatic.ipynb'), 'wt') as f:
+        nbformat.write(nb, f)
+
+    job.write("Commiting changes")
+    run(job, ["git", "commit", "-am", "Automatic generation"], github_path)
+    job.write("Pushing GitHub repository")
+    run(job, ["git", "push"], github_path)
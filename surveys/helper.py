@@ -1,82 +1,166 @@
 """Helpers functions to build a survey"""
 import csv
+import datetime
+import hashlib
+import json
 
 from collections import Counter, OrderedDict
 from copy import copy
 from functools import wraps
 from itertools import groupby
 
-from flask import session, render_template, redirect, url_for, flash
-from flask_babel import gettext
+from flask import session, render_template, redirect, url_for
+from flask import request, current_app, Markup
+from flask_babel import gettext, get_locale
 from flask_nav.elements import View
-
-from .db import db, Answer
-
-def create_csv(csvfile, forms, sep=';', internal_sep=',', raw=True):
-    """Create csv with results"""
-    writer = csv.writer(csvfile, delimiter=sep)
-    writer.writerow(
+from flask_wtf.csrf import generate_csrf
+
+from .buffer import submit
+from .cache import LRUCache
+from .catalog import current_catalog
+from .db import db, Answer, Respondent, write_answer, delete_answers
+from .db import summarize, group_questions, Tally, tally_keys
+
+def respondent_answers(query=None):
+    """Yield (uid, answers) for each respondent in a single ordered scan"""
+    query = query if query is not None else Answer.query
+    answers = query.order_by(
+        Answer.uid, Answer.created_at, Answer.id
+    ).yield_per(1000)
+    for uid, user_answers in groupby(answers, lambda x: x.uid):
+        yield uid, list(user_answers)
+
+
+def touched_answers(uids, chunk=500):
+    """Yield (uid, answers) for a sorted list of respondents"""
+    for start in range(0, len(uids), chunk):
+        query = Answer.query.filter(Answer.uid.in_(uids[start:start + chunk]))
+        for item in respondent_answers(query):
+            yield item
+
+
+def csv_rows(forms, internal_sep=',', raw=True, answers=None):
+    """Yield header and one csv row per respondent"""
+    yield (
         ['uid'] + list(forms.keys()) +
         ['first', 'last', 'time', 'finished', 'language', 'origin']
     )
-
-    uids = list(db.session.query(Answer.uid).distinct())
-    for uid, in uids:
-        user_answers = list(
-            Answer.query.filter_by(uid=uid).order_by(Answer.created_at)
-        )
+    answers = answers if answers is not None else respondent_answers()
+    catalog = None if raw else current_catalog()
+    for uid, user_answers in answers:
         uanswers = {
             num: {a.field: a.value for a in answers}
-            for num, answers in groupby(user_answers, lambda x: x.question)
+            for num, answers in group_questions(user_answers).items()
         }
+        summary = summarize(user_answers)
         uid = uid if isinstance(uid, str) else uid.decode('ascii')
-        row = [uid] + [
+        yield [uid] + [
             qform.survey_answers(uanswers.get(number, None),
-                                 raw=raw, sep=internal_sep)
+                                 raw=raw, sep=internal_sep, catalog=catalog)
             for number, qform in forms.items()
         ] + [
-            str(user_answers[0].created_at),
-            str(user_answers[-1].created_at),
-            str(user_answers[-1].created_at - user_answers[0].created_at),
-            'yes' if 'finish' in uanswers else 'no',
-            Counter(
-                next(answers).lang
-                for _, answers in groupby(user_answers, lambda x: x.question)
-            ).most_common()[0][0],
-            uanswers.get('origin', {'submit': 'main'})['submit'],
+            str(summary['first']),
+            str(summary['last']),
+            str(summary['last'] - summary['first']),
+            'yes' if summary['finished'] else 'no',
+            summary['language'],
+            summary['origin'],
         ]
-        writer.writerow(row)
 
-def save_answer(number, data=None):
+
+def rebuild_respondents(chunk=1000):
+    """Recompute the respondent summary table from all answers"""
+    Respondent.query.delete()
+    now = datetime.datetime.utcnow()
+    rows = []
+    for uid, user_answers in respondent_answers():
+        rows.append(dict(summarize(user_answers), uid=uid, updated_at=now))
+        if len(rows) >= chunk:
+            db.session.execute(Respondent.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(Respondent.__table__.insert(), rows)
+    db.session.commit()
+    return Respondent.query.count()
+
+
+def count_tallies():
+    """Count tally keys with a full scan of the answers"""
+    counts = Counter()
+    for _, user_answers in respondent_answers():
+        questions = {}
+        for answer in user_answers:
+            questions.setdefault(answer.question, {})[answer.field] = answer.value
+        for number, values in questions.items():
+            counts.update(tally_keys(number, values))
+    return counts
+
+
+def verify_tallies(fix=False):
+    """Compare tally counters with a full recount. Return mismatches"""
+    counts = count_tallies()
+    stored = {
+        (tally.question, tally.field, tally.value): tally.count
+        for tally in Tally.query
+    }
+    mismatches = {
+        key: (stored.get(key, 0), counts.get(key, 0))
+        for key in set(counts) | set(stored)
+        if stored.get(key, 0) != counts.get(key, 0)
+    }
+    if fix and mismatches:
+        Tally.query.delete()
+        if counts:
+            db.session.execute(Tally.__table__.insert(), [
+                {'question': question, 'field': field, 'value': value,
+                 'count': count}
+                for (question, field, value), count in counts.items()
+            ])
+        db.session.commit()
+    return mismatches
+
+
+def create_csv(csvfile, forms, sep=';', internal_sep=',', raw=True):
+    """Create csv with results"""
+    writer = csv.writer(csvfile, delimiter=sep)
+    writer.writerows(csv_rows(forms, internal_sep=internal_sep, raw=raw))
+
+
+class _Line(object):
+    """File-like object that returns what is written to it"""
+    # pylint: disable=too-few-public-methods
+
+    def write(self, value):  # pylint: disable=no-self-use
+        """Return written value"""
+        return value
+
+
+def stream_csv(forms, sep=';', internal_sep=',', raw=True):
+    """Yield csv with results line by line"""
+    writer = csv.writer(_Line(), delimiter=sep)
+    for row in csv_rows(forms, internal_sep=internal_sep, raw=raw):
+        yield writer.writerow(row)
+
+
+def answer_write(number, data=None):
+    """Return the (func, args) database write of an answer"""
     data = data if data is not None else session['s_{}_a'.format(number)]
     uid = session['s_uid']
     lang = session['s_lang']
-    Answer.query.filter_by(uid=uid, question=number).delete()
-    for key, value in data.items():
-        if value:
-            db.session.add(Answer(uid, number, lang, key, str(value)))
-    db.session.commit()
+    return write_answer, (uid, number, lang, dict(data))
 
-def last(order):
-    """Return last visited"""
-    for elements in reversed(order):
-        if not isinstance(elements, tuple):
-            elements = (elements,)
-        for element in elements:
-            number = element.lower()
-            sid = 's_{}'.format(number)
-            if sid in session:
-                return tuple(x.lower() for x in elements)
-    return ('index',)
 
+def save_answer(number, data=None):
+    func, args = answer_write(number, data)
+    submit(func, args, final=(number == 'finish'))
 
 def erase(numbers):
     """Remove question from NavBar"""
     if isinstance(numbers, str):
         numbers = [numbers]
     uid = session['s_uid']
+    submit(delete_answers, (uid, list(numbers)))
     for number in numbers:
-        Answer.query.filter_by(uid=uid, question=number).delete()
         sid = 's_{}'.format(number)
         sid_ans = sid + '_a'
         if sid in session:
@@ -84,12 +168,46 @@ def erase(numbers):
         if sid_ans in session:
             del session[sid_ans]
 
-    db.session.commit()
 
+FRAGMENT_CSRF = '__csrf_token__'
 
-def question(form, title):
-    """Render question template"""
-    return render_template('question.html', form=form, title=title)
+
+def init_fragment_cache(app):
+    """Create the question form fragment cache"""
+    app.extensions['fragments'] = LRUCache(app.config['FRAGMENT_CACHE_SIZE'])
+
+
+def fragment_key(number, prefill, options):
+    """Return fragment cache key of a question form"""
+    state = json.dumps([prefill, options], sort_keys=True, default=str)
+    return (number, str(get_locale()),
+            hashlib.sha1(state.encode('utf-8')).hexdigest())
+
+
+def csrf_token():
+    """Return the CSRF token of the request or None if CSRF is disabled"""
+    if not current_app.config.get('WTF_CSRF_ENABLED', True):
+        return None
+    return generate_csrf()
+
+
+def cached_fragment(key):
+    """Return cached form html with the current CSRF token or None"""
+    html = current_app.extensions['fragments'].get(key)
+    token = csrf_token()
+    if html is not None and token is not None:
+        html = html.replace(FRAGMENT_CSRF, token)
+    return html
+
+
+def question(form, title, key=None):
+    """Render question template. Cache the form html under key"""
+    html = Markup(render_template('question_form.html', form=form))
+    if key is not None and not form.errors:
+        token = csrf_token()
+        current_app.extensions['fragments'].set(
+            key, html.replace(token, FRAGMENT_CSRF) if token else html)
+    return render_template('question.html', title=title, form_html=html)
 
 
 def question_url(number=None, lang=None):
@@ -119,6 +237,13 @@ def question_form(number, next_question, form_class, title, alternative=None, op
     """Process GET and POST of a question form"""
     alternative = alternative or (lambda form: False)
     answer = 's_{}_a'.format(number)
+    key = None
+    if request.method == 'GET':
+        key = fragment_key(number, session.get(answer, {}), options)
+        html = cached_fragment(key)
+        if html is not None:
+            return render_template('question.html', title=title,
+                                   form_html=html)
     form = form_class(**session.get(answer, {}))
     if hasattr(form, '_categories'):
         form._categories = OrderedDict([
@@ -133,7 +258,7 @@ def question_form(number, next_question, form_class, title, alternative=None, op
         save_answer(number)
         # ToDo: save
         return goto(next_question)
-    return question(form, title)
+    return question(form, title, key)
 
 
 def radio_question(number, next_question, form_class, title, options=None):
@@ -155,39 +280,19 @@ def option(number, default='no'):
     return answer(number).get('options', default)
 
 
-def survey_started(func):
-    """Check if survey has started"""
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        """Check if survey has started"""
-        if 's_uid' not in session:
-            flash(gettext('Invalid Session. Restarting'))
-            return goto('index')
-        return func(*args, **kwargs)
-    return wrapper
-
-
-def to_tuple(element):
-    if isinstance(element, tuple):
-        return element
-    return (element,)
-
-
-def require(numbers):
-    """Require previous question"""
-    if isinstance(numbers, str):
-        numbers = [numbers]
-    def decorator(func):
-        """Check if survey has started"""
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            """Check if survey has started"""
-            go_back = last(numbers)
-            if to_tuple(numbers[-1]) != go_back:
-                return goto(go_back if go_back != ('index',) else numbers[0])
-            return func(*args, **kwargs)
-        return wrapper
-    return decorator
+def visit(number, minutes):
+    """Set lang, url, accessed page and remaining minutes"""
+    state = session._get_current_object()
+    state['s_lang'] = state['s_lang']
+    state['s_url'] = number
+    state['s_' + number] = True
+    if minutes == 1:
+        state['s_minutes'] = gettext('~1 minute remaining')
+    elif isinstance(minutes, int):
+        state['s_minutes'] = gettext(
+            '~%(minutes)s minutes remaining', minutes=minutes)
+    else:
+        state['s_minutes'] = minutes
 
 
 def set_navbar(minutes):
@@ -197,25 +302,8 @@ def set_navbar(minutes):
         @wraps(func)
         def wrapper(*args, **kwargs):
             """Set lang, url, accessed page and remaining minutes"""
-            lang = session['s_lang']
-            session['s_lang'] = lang
-            session['s_url'] = func.__name__
-            session['s_' + func.__name__] = True
-            if minutes == 1:
-                session['s_minutes'] = gettext('~1 minute remaining')
-            elif isinstance(minutes, int):
-                session['s_minutes'] = gettext(
-                    '~%(minutes)s minutes remaining', minutes=minutes)
-            else:
-                session['s_minutes'] = minutes
+            visit(func.__name__, minutes)
             return func(*args, **kwargs)
 
         return wrapper
     return decorator
-
-def survey_question(numbers, minutes):
-    """Condenses survey_started, require, and set_navbar"""
-    def decorator(func):
-        """Condenses survey_started, require, and set_navbar"""
-        return survey_started(require(numbers)(set_navbar(minutes)(func)))
-    return decorator
@@ -0,0 +1,226 @@
+"""Bulk ingestion of answers collected offline, one JSON record per line
+
+    {"uid": "...", "question": "p1", "lang": "en", "field": "options",
+     "value": "yes", "created_at": "2017-06-01T10:00:00"}
+
+Records add or replace single fields. A record older than the stored field
+is skipped, so a kiosk may upload the same file again
+"""
+import datetime
+import json
+import time
+from collections import Counter
+
+from flask import current_app
+from wtforms.fields import BooleanField, RadioField, SelectField
+
+from . import survey
+from .db import db, Answer, Respondent, summarize
+from .db import bump_tallies, tally_deltas, tally_keys
+from .forms import country_choices
+from .helper import touched_answers
+
+FIELDS = ('uid', 'question', 'lang', 'field', 'value', 'created_at')
+# Questions saved outside the survey forms, with a single submit field
+SUBMITS = ('origin', 'index', 'finish')
+# Rejected lines reported back
+MAX_ERRORS = 100
+
+
+def allowed_values(schema, field):
+    """Return the valid values of a choice field, or None for free text"""
+    kind = schema.kinds[field]
+    if issubclass(kind, BooleanField):
+        return {'True'}
+    if issubclass(kind, RadioField):
+        values = set(schema.choices.get(field, ())) | {'None'}
+        if schema.dynamic is not None:
+            dynamic = schema.dynamic.survey_schema()
+            values |= {
+                name for name, kind in dynamic.kinds.items()
+                if issubclass(kind, BooleanField)
+            }
+        return values
+    if issubclass(kind, SelectField):
+        return {raw for raw, _ in country_choices('en') if raw}
+    return None
+
+
+def parse_time(value):
+    """Parse an ISO 8601 timestamp into naive UTC"""
+    if not isinstance(value, str):
+        raise ValueError('created_at must be an ISO 8601 string')
+    created_at = datetime.datetime.fromisoformat(value)
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(datetime.timezone.utc)
+        created_at = created_at.replace(tzinfo=None)
+    return created_at
+
+
+def validate_record(record):
+    """Return the answer row of a decoded record. Raises ValueError"""
+    if not isinstance(record, dict):
+        raise ValueError('Record must be an object')
+    missing = [key for key in FIELDS if record.get(key) in (None, '')]
+    if missing:
+        raise ValueError('Missing {}'.format(', '.join(missing)))
+    uid, question, lang, field = (
+        record[key] for key in ('uid', 'question', 'lang', 'field'))
+    if not all(isinstance(value, str) for value in (uid, question, lang, field)):
+        raise ValueError('uid, question, lang and field must be strings')
+    if len(uid) > 80:
+        raise ValueError('uid is longer than 80 characters')
+    if lang not in current_app.config['LANGUAGES']:
+        raise ValueError('Invalid lang: {}'.format(lang))
+    value = record['value']
+    if isinstance(value, (dict, list)):
+        raise ValueError('value must be a string')
+    value = str(value)
+    if len(value) > 120:
+        raise ValueError('value is longer than 120 characters')
+    if question in SUBMITS:
+        if field != 'submit':
+            raise ValueError('Invalid field: {}.{}'.format(question, field))
+    elif question in survey.FORMS:
+        schema = survey.FORMS[question].survey_schema()
+        if field not in schema.kinds:
+            raise ValueError('Invalid field: {}.{}'.format(question, field))
+        values = allowed_values(schema, field)
+        if values is not None and value not in values:
+            raise ValueError('Invalid value of {}.{}: {}'.format(
+                question, field, value))
+    else:
+        raise ValueError('Invalid question: {}'.format(question))
+    return {
+        'uid': uid, 'question': question, 'lang': lang, 'field': field,
+        'value': value, 'created_at': parse_time(record['created_at']),
+    }
+
+
+def parse_lines(lines):
+    """Yield (line number, row, error) of NDJSON lines. Blank lines are skipped"""
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, validate_record(json.loads(line)), None
+        except ValueError as error:
+            yield number, None, str(error)
+
+
+def stored_answers(uids, chunk=500):
+    """Return {(uid, question, field): (id, value, created_at)}"""
+    stored = {}
+    for start in range(0, len(uids), chunk):
+        for id_, uid, question, field, value, created_at in db.session.query(
+                Answer.id, Answer.uid, Answer.question, Answer.field,
+                Answer.value, Answer.created_at
+        ).filter(Answer.uid.in_(uids[start:start + chunk])):
+            stored[(uid, question, field)] = (id_, value, created_at)
+    return stored
+
+
+def ingest_deltas(stored, changed):
+    """Return the tally changes of writing changed rows over stored"""
+    before = {}
+    for (uid, question, field), (_, value, _) in stored.items():
+        before.setdefault((uid, question), {})[field] = value
+    after = {}
+    for row in changed:
+        key = (row['uid'], row['question'])
+        if key not in after:
+            after[key] = dict(before.get(key, {}))
+        after[key][row['field']] = row['value']
+    deltas = Counter()
+    for (uid, question), values in after.items():
+        deltas.update(tally_deltas(
+            tally_keys(question, before.get((uid, question), {})),
+            tally_keys(question, values)
+        ))
+    return deltas
+
+
+def refresh_respondents(uids, chunk=500):
+    """Replace the summary rows of respondents. Does not commit"""
+    now = datetime.datetime.utcnow()
+    rows = [
+        dict(summarize(user_answers), uid=uid, updated_at=now)
+        for uid, user_answers in touched_answers(uids, chunk=chunk)
+    ]
+    for start in range(0, len(uids), chunk):
+        Respondent.query.filter(
+            Respondent.uid.in_(uids[start:start + chunk])
+        ).delete(synchronize_session=False)
+    if rows:
+        db.session.execute(Respondent.__table__.insert(), rows)
+
+
+def write_chunk(rows):
+    """Insert or update a chunk of rows in one transaction.
+
+    Returns (written, skipped)
+    """
+    latest = {}
+    for row in rows:
+        key = (row['uid'], row['question'], row['field'])
+        if key not in latest or latest[key]['created_at'] <= row['created_at']:
+            latest[key] = row
+    uids = sorted({row['uid'] for row in latest.values()})
+    stored = stored_answers(uids)
+    inserts, updates = [], []
+    for key, row in latest.items():
+        if key not in stored:
+            inserts.append(row)
+        elif stored[key][2] < row['created_at']:
+            updates.append(dict(row, id=stored[key][0]))
+    changed = inserts + updates
+    if not changed:
+        return 0, len(rows)
+    try:
+        if inserts:
+            db.session.execute(Answer.__table__.insert(), inserts)
+        if updates:
+            db.session.bulk_update_mappings(Answer, updates)
+        bump_tallies(ingest_deltas(stored, changed))
+        refresh_respondents(sorted({row['uid'] for row in changed}))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(changed), len(rows) - len(changed)
+
+
+def ingest(lines, chunk=None):
+    """Validate and write NDJSON answer lines in chunked transactions.
+
+    Invalid lines are rejected and the others written. Returns counts,
+    the first MAX_ERRORS errors and the throughput
+    """
+    chunk = chunk or current_app.config['INGEST_CHUNK']
+    result = {'written': 0, 'skipped': 0, 'rejected': 0, 'errors': []}
+    start = time.perf_counter()
+    rows = []
+
+    def flush():
+        """Write the pending rows"""
+        written, skipped = write_chunk(rows)
+        result['written'] += written
+        result['skipped'] += skipped
+        del rows[:]
+
+    for number, row, error in parse_lines(lines):
+        if error is not None:
+            result['rejected'] += 1
+            if len(result['errors']) < MAX_ERRORS:
+                result['errors'].append({'line': number, 'error': error})
+            continue
+        rows.append(row)
+        if len(rows) >= chunk:
+            flush()
+    if rows:
+        flush()
+    seconds = time.perf_counter() - start
+    result['seconds'] = round(seconds, 3)
+    result['rows_per_second'] = round(
+        (result['written'] + result['skipped']) / seconds if seconds else 0)
+    return result
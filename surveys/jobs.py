@@ -0,0 +1,167 @@
+"""Background jobs with status and log polling
+
+Job state lives in the job table, so any worker process can report a job
+and only one job per key runs across processes
+"""
+import binascii
+import datetime
+import json
+import os
+import threading
+import traceback
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from .db import db, JobRecord
+
+ACTIVE = ('queued', 'running')
+
+
+class Job(object):
+    """Status and log of a background run"""
+
+    table = JobRecord.__table__
+
+    def __init__(self, key, engine=None):
+        self.id = binascii.hexlify(os.urandom(8)).decode('ascii')
+        self.key = key
+        self.status = 'queued'
+        self.log = []
+        self.created_at = datetime.datetime.utcnow()
+        self.finished_at = None
+        self.engine = engine
+
+    @classmethod
+    def from_row(cls, row):
+        """Return a read-only job of a job table row"""
+        job = cls(row.key)
+        job.id = row.id
+        job.status = row.status
+        job.log = json.loads(row.log or '[]')
+        job.created_at = row.created_at
+        job.finished_at = row.finished_at
+        return job
+
+    def as_row(self):
+        """Return the job table values of the job"""
+        return {
+            'id': self.id,
+            'key': self.key,
+            'active_key': self.key if self.active else None,
+            'status': self.status,
+            'log': json.dumps(self.log),
+            'created_at': self.created_at,
+            'updated_at': datetime.datetime.utcnow(),
+            'finished_at': self.finished_at,
+        }
+
+    def save(self):
+        """Write the job state"""
+        values = self.as_row()
+        del values['id']
+        with self.engine.begin() as conn:
+            conn.execute(self.table.update().where(
+                self.table.c.id == self.id).values(**values))
+
+    def write(self, line):
+        """Append line to the log"""
+        self.log.append(line)
+        self.save()
+
+    @property
+    def active(self):
+        """Check if job is queued or running"""
+        return self.status in ACTIVE
+
+    def as_dict(self):
+        """Return json-serializable job state"""
+        return OrderedDict([
+            ('id', self.id),
+            ('key', self.key),
+            ('status', self.status),
+            ('created_at', str(self.created_at)),
+            ('finished_at', str(self.finished_at or '')),
+            ('log', self.log),
+        ])
+
+
+class JobRunner(object):
+    """Run jobs in threads. Concurrent submits of a key share one job"""
+
+    table = JobRecord.__table__
+
+    def active_job(self, conn, key, timeout):
+        """Return the active job of key, failing it if it stopped updating"""
+        table = self.table
+        stale = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=timeout)
+        conn.execute(table.update().where(
+            (table.c.active_key == key) & (table.c.updated_at < stale)
+        ).values(status='failed', active_key=None,
+                 finished_at=datetime.datetime.utcnow()))
+        row = conn.execute(
+            select(table).where(table.c.active_key == key)).first()
+        return Job.from_row(row) if row is not None else None
+
+    def prune(self, conn, history):
+        """Delete finished jobs beyond the newest history ones"""
+        table = self.table
+        newest = select(table.c.id).order_by(
+            table.c.created_at.desc()).limit(history)
+        conn.execute(table.delete().where(
+            table.c.active_key.is_(None) &
+            table.c.id.notin_(select(newest.subquery().c.id))
+        ))
+
+    def submit(self, key, func, *args):
+        """Start func(job, *args) unless a job for key is active"""
+        config = current_app.config
+        engine = db.get_engine(current_app._get_current_object())
+        with engine.begin() as conn:
+            job = self.active_job(conn, key, config['JOB_TIMEOUT'])
+            if job is not None:
+                return job
+            self.prune(conn, config['JOB_HISTORY'])
+        job = Job(key, engine)
+        try:
+            with engine.begin() as conn:
+                conn.execute(self.table.insert(), job.as_row())
+        except IntegrityError:
+            # Another process started a job for key in the meantime
+            with engine.begin() as conn:
+                active = self.active_job(conn, key, config['JOB_TIMEOUT'])
+            if active is None:
+                raise
+            return active
+        thread = threading.Thread(
+            target=self.run, args=(job, func, args),
+            name='job-{}'.format(job.id), daemon=True
+        )
+        thread.start()
+        return job
+
+    def get(self, job_id):
+        """Return job by id or None"""
+        row = db.session.execute(
+            select(self.table).where(self.table.c.id == job_id)).first()
+        return Job.from_row(row) if row is not None else None
+
+    def run(self, job, func, args):  # pylint: disable=no-self-use
+        """Run job and record its status"""
+        job.status = 'running'
+        job.save()
+        try:
+            func(job, *args)
+            job.status = 'done'
+        except Exception:  # pylint: disable=broad-except
+            job.log.append(traceback.format_exc())
+            job.status = 'failed'
+        finally:
+            job.finished_at = datetime.datetime.utcnow()
+            job.save()
+
+
+jobs = JobRunner()
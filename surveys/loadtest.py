@@ -0,0 +1,85 @@
+"""Concurrent load test of the engine profiles
+
+    $ DATABASE_URL=sqlite:///bench.db python manage.py load -n 100 -c 16
+"""
+import threading
+import time
+
+from .bench import client_app, report, walk_survey
+from .db import db, init_engine_profile
+
+
+def profile_app(profile):
+    """Return a client app whose engine uses an ENGINE_PROFILES entry"""
+    app = client_app()
+    app.config['ENGINE_PROFILE'] = profile
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {}
+    init_engine_profile(app)
+    return app
+
+
+def reset_journal(app):
+    """Set the SQLite journal mode of the profile, which persists in the file"""
+    engine = db.get_engine(app)
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = app.config['SQLALCHEMY_ENGINE_OPTIONS'].get('pragmas', {})
+    with engine.connect() as connection:
+        connection.exec_driver_sql('PRAGMA journal_mode={}'.format(
+            pragmas.get('journal_mode', 'DELETE')))
+
+
+def run_load(app, respondents, concurrency):
+    """Walk the survey from concurrent threads.
+
+    Returns (wall seconds, survey durations in ms, failed surveys)
+    """
+    seeds = list(range(respondents))
+    lock = threading.Lock()
+    durations, failures = [], []
+
+    def worker():
+        """Walk surveys until no seed is left"""
+        while True:
+            with lock:
+                if not seeds:
+                    return
+                seed = seeds.pop()
+            start = time.perf_counter()
+            try:
+                walk_survey(app.test_client(), seed=seed)
+            except Exception as error:  # pylint: disable=broad-except
+                with lock:
+                    failures.append(error)
+                continue
+            with lock:
+                durations.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, durations, failures
+
+
+def load(respondents=100, concurrency=8, profiles=None):
+    """Surveys per second of concurrent respondents by engine profile"""
+    if profiles is None:
+        auto = profile_app('auto').extensions['engine_profile']
+        profiles = ['default'] + ([auto] if auto != 'default' else [])
+    db.create_all()
+    # Switching the journal mode needs the only connection to the file
+    db.engine.dispose()
+    for profile in profiles:
+        app = profile_app(profile)
+        reset_journal(app)
+        seconds, durations, failures = run_load(
+            app, respondents, concurrency)
+        print('{:<16} {:6.1f} surveys/s, {} failed{}'.format(
+            profile, len(durations) / seconds, len(failures),
+            ' ({})'.format(failures[0]) if failures else ''))
+        if durations:
+            report(profile + ' survey', durations)
+        db.get_engine(app).dispose()
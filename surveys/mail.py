@@ -1,3 +1,178 @@
-from flask_mail import Mail
+"""Flask-Mail instance and background outbox"""
+import atexit
+import binascii
+import datetime
+import json
+import os
+import queue
+import smtplib
+import threading
+import time
+
+from flask import current_app
+from flask_mail import Mail, Connection, sanitize_address, sanitize_addresses
 
 mail = Mail()
+
+
+class Outbox(object):
+    """Send queued messages on a worker thread over one SMTP connection"""
+
+    def __init__(self, app):
+        self.app = app
+        self.retries = app.config['MAIL_RETRIES']
+        self.backoff = app.config['MAIL_RETRY_BACKOFF']
+        self.idle = app.config['MAIL_OUTBOX_IDLE']
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def put(self, message):
+        """Enqueue message. Start the worker on first use"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name='outbox', daemon=True
+                )
+                self.thread.start()
+                atexit.register(self.close)
+        self.queue.put(message)
+
+    def close(self):
+        """Send pending messages and stop the worker"""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def run(self):
+        """Open a connection per burst of messages"""
+        while True:
+            message = self.queue.get()
+            if message is None:
+                return
+            with self.app.app_context():
+                if not self.deliver(message):
+                    return
+
+    def deliver(self, message):
+        """Send message and the ones that arrive within idle seconds.
+
+        Return False if the worker was asked to stop
+        """
+        state = self.app.extensions['mail']
+        connection = Connection(state)
+        connection.host = None
+        connection.num_emails = 0
+        try:
+            while True:
+                self.send(state, connection, message)
+                try:
+                    message = self.queue.get(timeout=self.idle)
+                except queue.Empty:
+                    return True
+                if message is None:
+                    return False
+        finally:
+            self.disconnect(connection)
+
+    def send(self, state, connection, message):
+        """Send message. Reconnect and retry with exponential backoff.
+
+        Messages that still fail are kept as dead letters
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                if connection.host is None and not state.suppress:
+                    connection.host = connection.configure_host()
+                connection.send(message)
+                return
+            except (smtplib.SMTPException, OSError) as error:
+                failure = error
+                self.app.logger.warning(
+                    'Sending %r to %s failed (attempt %d)', message.subject,
+                    ', '.join(message.recipients), attempt + 1, exc_info=True)
+                self.disconnect(connection)
+                if attempt < self.retries:
+                    time.sleep(self.backoff * 2 ** attempt)
+        path = save_dead_letter(self.app, message, failure)
+        self.app.logger.error('Gave up sending %r to %s. Kept in %s',
+                              message.subject, ', '.join(message.recipients),
+                              path)
+
+    @staticmethod
+    def disconnect(connection):
+        """Close the SMTP connection, ignoring errors"""
+        if connection.host is not None:
+            try:
+                connection.host.quit()
+            except (smtplib.SMTPException, OSError):
+                connection.host.close()
+            connection.host = None
+
+
+def save_dead_letter(app, message, error):
+    """Write an undelivered message to MAIL_DEAD_LETTERS. Return its path"""
+    directory = app.config['MAIL_DEAD_LETTERS']
+    os.makedirs(directory, exist_ok=True)
+    now = datetime.datetime.utcnow()
+    path = os.path.join(directory, '{}-{}.json'.format(
+        now.strftime('%Y%m%dT%H%M%S'),
+        binascii.hexlify(os.urandom(4)).decode('ascii')))
+    with open(path, 'w', encoding='utf-8') as letter:
+        json.dump({
+            'subject': message.subject,
+            'sender': sanitize_address(message.sender),
+            'recipients': list(sanitize_addresses(message.send_to)),
+            'failed_at': str(now),
+            'error': str(error),
+            'message': message.as_string(),
+        }, letter)
+    return path
+
+
+def dead_letters(app):
+    """Return sorted (path, letter) of undelivered messages"""
+    directory = app.config['MAIL_DEAD_LETTERS']
+    if not os.path.isdir(directory):
+        return []
+    result = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.json'):
+            path = os.path.join(directory, name)
+            with open(path, encoding='utf-8') as letter:
+                result.append((path, json.load(letter)))
+    return result
+
+
+def resend_dead_letters(app):
+    """Send the dead letters again. Return (sent, failed)"""
+    sent = failed = 0
+    letters = dead_letters(app)
+    if not letters:
+        return sent, failed
+    connection = Connection(app.extensions['mail'])
+    try:
+        connection.host = connection.configure_host()
+        for path, letter in letters:
+            try:
+                connection.host.sendmail(letter['sender'], letter['recipients'],
+                                         letter['message'].encode('utf-8'))
+            except smtplib.SMTPException:
+                app.logger.warning('Resending %s failed', path, exc_info=True)
+                failed += 1
+                continue
+            os.remove(path)
+            sent += 1
+    finally:
+        Outbox.disconnect(connection)
+    return sent, failed
+
+
+def init_outbox(app):
+    """Start the mail outbox worker"""
+    app.extensions['outbox'] = Outbox(app)
+
+
+def queue_mail(message):
+    """Queue message in the outbox of the current app"""
+    current_app.extensions['outbox'].put(message)
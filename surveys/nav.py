@@ -13,6 +13,22 @@ class ExtendedNavbar(NavigationItem):
         self.items = items
         self.right_items = right_items
 
+class CachedNavbar(NavigationItem):
+    """Navbar rendered once per key and then served from a cache"""
+
+    def __init__(self, cache, key, build):
+        self.cache = cache
+        self.key = key
+        self.build = build
+
+    def render(self, renderer=None, **kwargs):
+        key = (self.key, renderer, tuple(sorted(kwargs.items())))
+        html = self.cache.get(key)
+        if html is None:
+            html = self.build().render(renderer, **kwargs)
+            self.cache.set(key, html)
+        return html
+
 class CustomBootstrapRenderer(BootstrapRenderer):
 
     def visit_ExtendedNavbar(self, node):
@@ -0,0 +1,247 @@
+"""Server-side sessions. The cookie only carries a signed opaque id"""
+import binascii
+import os
+import tempfile
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from flask.sessions import session_json_serializer
+from itsdangerous import Signer, BadSignature
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import CallbackDict
+
+from .cache import LRUCache
+from .db import db, SessionData, upsert_insert
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dict identified by sid"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            """Mark session as modified"""
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class MemorySessionStore(object):
+    """In-process LRU store. Sessions do not survive restarts"""
+
+    def __init__(self, maxsize=10000):
+        self.cache = LRUCache(maxsize)
+
+    def load(self, sid):
+        """Return stored data or None"""
+        item = self.cache.get(sid)
+        if item is None or item[1] < time.time():
+            return None
+        return item[0]
+
+    def save(self, sid, data, lifetime):
+        """Store data for lifetime seconds"""
+        self.cache.set(sid, (data, time.time() + lifetime))
+
+    def delete(self, sid):
+        """Remove sid"""
+        self.cache.pop(sid)
+
+    def purge(self):  # pylint: disable=no-self-use
+        """Expired sessions are evicted by the LRU. Return 0"""
+        return 0
+
+
+class FileSystemSessionStore(object):
+    """One file per session in a directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, sid):
+        """Return file path of sid"""
+        return os.path.join(self.directory, sid)
+
+    def load(self, sid):
+        """Return stored data or None"""
+        try:
+            with open(self.path(sid), 'r', encoding='utf-8') as session_file:
+                expires = float(session_file.readline())
+                if expires < time.time():
+                    return None
+                return session_file.read()
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, sid, data, lifetime):
+        """Atomically write data for lifetime seconds"""
+        handle, temp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'w', encoding='utf-8') as session_file:
+            session_file.write('{}\n'.format(time.time() + lifetime))
+            session_file.write(data)
+        os.replace(temp, self.path(sid))
+
+    def delete(self, sid):
+        """Remove sid"""
+        try:
+            os.remove(self.path(sid))
+        except OSError:
+            pass
+
+    def purge(self):
+        """Remove expired session files. Return how many were removed"""
+        now = time.time()
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as session_file:
+                    expires = float(session_file.readline())
+                if expires < now:
+                    os.remove(path)
+                    removed += 1
+            except (IOError, OSError, ValueError):
+                continue
+        return removed
+
+
+class DatabaseSessionStore(object):
+    """Store sessions in the session table of the survey database"""
+
+    table = SessionData.__table__
+
+    def load(self, sid):
+        """Return stored data or None"""
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                self.table.select().where(self.table.c.sid == sid)
+            ).first()
+        if row is None or row.expires < time.time():
+            return None
+        return row.data
+
+    def save(self, sid, data, lifetime):
+        """Insert or replace data of sid.
+
+        Concurrent requests of one session may both write it, so this is an
+        upsert where the dialect has one
+        """
+        values = {'data': data, 'expires': time.time() + lifetime}
+        update = self.table.update().where(self.table.c.sid == sid)
+        insert = upsert_insert()
+        if insert is not None:
+            stmt = insert(self.table).values(sid=sid, **values)
+            with db.engine.begin() as conn:
+                conn.execute(stmt.on_conflict_do_update(
+                    index_elements=['sid'], set_=values))
+            return
+        with db.engine.begin() as conn:
+            if conn.execute(update.values(**values)).rowcount:
+                return
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(self.table.insert(), dict(values, sid=sid))
+        except IntegrityError:
+            # Another request of the session inserted it in the meantime
+            with db.engine.begin() as conn:
+                conn.execute(update.values(**values))
+
+    def delete(self, sid):
+        """Remove sid"""
+        with db.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.sid == sid))
+
+    def purge(self):
+        """Delete expired sessions. Return how many were deleted"""
+        with db.engine.begin() as conn:
+            return conn.execute(self.table.delete().where(
+                self.table.c.expires < time.time())).rowcount
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keep session data in a store and a signed session id in the cookie"""
+    serializer = session_json_serializer
+    session_class = ServerSession
+
+    def __init__(self, store, purge_interval=0):
+        self.store = store
+        self.purge_interval = purge_interval
+        self.next_purge = time.time() + purge_interval
+
+    def purge_expired(self):
+        """Purge expired sessions at most once per purge_interval"""
+        if not self.purge_interval or time.time() < self.next_purge:
+            return
+        self.next_purge = time.time() + self.purge_interval
+        self.store.purge()
+
+    def get_signer(self, app):
+        """Return signer for session ids"""
+        if not app.secret_key:
+            return None
+        return Signer(app.secret_key, salt='server-session')
+
+    def open_session(self, app, request):
+        signer = self.get_signer(app)
+        if signer is None:
+            return None
+        cookie = request.cookies.get(app.config['SESSION_COOKIE_NAME'])
+        if cookie:
+            try:
+                sid = signer.unsign(cookie).decode('ascii')
+            except BadSignature:
+                sid = None
+            data = self.store.load(sid) if sid else None
+            if data is not None:
+                return self.session_class(self.serializer.loads(data), sid=sid)
+        sid = binascii.hexlify(os.urandom(24)).decode('ascii')
+        return self.session_class(sid=sid, new=True)
+
+    def save_session(self, app, session, response):
+        name = app.config['SESSION_COOKIE_NAME']
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.modified:
+            lifetime = app.permanent_session_lifetime.total_seconds()
+            self.store.save(
+                session.sid, self.serializer.dumps(dict(session)), lifetime
+            )
+            self.purge_expired()
+        refresh = (session.permanent and
+                   app.config['SESSION_REFRESH_EACH_REQUEST'])
+        if session.new or refresh:
+            signer = self.get_signer(app)
+            response.set_cookie(
+                name, signer.sign(session.sid.encode('ascii')).decode('ascii'),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain, path=path,
+                secure=self.get_cookie_secure(app),
+            )
+
+
+def session_store(app):
+    """Create store for SESSION_BACKEND"""
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'memory':
+        return MemorySessionStore(app.config['SESSION_MEMORY_SIZE'])
+    if backend == 'filesystem':
+        return FileSystemSessionStore(app.config['SESSION_DIRECTORY'])
+    if backend == 'database':
+        return DatabaseSessionStore()
+    raise ValueError('Invalid SESSION_BACKEND: {}'.format(backend))
+
+
+def init_session(app):
+    """Replace the signed-cookie session unless SESSION_BACKEND is cookie"""
+    if app.config.get('SESSION_BACKEND', 'cookie') != 'cookie':
+        app.session_interface = ServerSessionInterface(
+            session_store(app), app.config['SESSION_PURGE_INTERVAL'])
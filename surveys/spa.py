@@ -0,0 +1,183 @@
+"""Single-page survey mode: the client walks the flow and submits once"""
+import binascii
+import os
+from collections import OrderedDict
+from copy import copy
+
+from flask import session, url_for
+from flask_babel import gettext, get_locale
+from werkzeug.datastructures import MultiDict
+from wtforms.fields import BooleanField, RadioField, SelectField
+from wtforms.fields import TextAreaField
+
+from . import survey
+from .buffer import submit_all
+from .db import write_answer
+from .forms import country_choices
+from .helper import answer_write
+
+# JSON values accepted as field values of a batch
+SCALARS = (str, int, float, bool, type(None))
+
+FIELD_KINDS = [
+    (BooleanField, 'bool'),
+    (RadioField, 'radio'),
+    (SelectField, 'select'),
+    (TextAreaField, 'textarea'),
+]
+
+
+def field_kind(field_class):
+    """Return the client widget of a field class"""
+    for base, kind in FIELD_KINDS:
+        if issubclass(field_class, base):
+            return kind
+    return 'text'
+
+
+def spa_questions():
+    """Return the fields of each question for the client"""
+    result = OrderedDict()
+    for number, form_class in survey.FORMS.items():
+        schema = form_class.survey_schema()
+        result[number] = {
+            'mode': form_class._mode,
+            'fields': [
+                {'name': field, 'kind': field_kind(schema.kinds[field])}
+                for field in schema.unbound_fields
+            ],
+            'specify': dict(schema.specify),
+            'limit': getattr(form_class, 'limit', None),
+        }
+    return result
+
+
+def spa_state(lang):
+    """Return flow, fields and urls of the single-page survey"""
+    return {
+        'lang': lang,
+        'order': list(survey.FORMS),
+        'flow': survey.FLOW.as_dict(),
+        'questions': spa_questions(),
+        'countries': country_choices(str(get_locale() or 'en')),
+        'translation': url_for('.translation', lang=lang),
+        'submit': url_for('.spa_answers', lang=lang),
+        'labels': {
+            'next': gettext('Next'),
+            'back': gettext('Back'),
+            'specify': gettext('Specify'),
+            'thanks': gettext('Thank you for the answers!'),
+            'restart': gettext('Restart'),
+        },
+    }
+
+
+def batch_errors(answers):
+    """Return the errors of a batch whose answers are not objects of
+    scalar values, or None
+    """
+    for number, fields in answers.items():
+        if not isinstance(fields, dict):
+            return {'question': number,
+                    'errors': {number: ['The answer must be an object']}}
+        nested = [
+            field for field, value in fields.items()
+            if not isinstance(value, SCALARS)
+        ]
+        if nested:
+            return {'question': number, 'errors': {
+                field: ['The value must be a string, number, boolean or null']
+                for field in nested
+            }}
+    return None
+
+
+def question_data(number, fields):
+    """Validate the fields of a question. Return (data, errors)"""
+    form_class = survey.FORMS[number]
+    formdata = MultiDict([
+        (field, value if isinstance(value, (str, bool)) else str(value))
+        for field, value in fields.items()
+        if value is not None and value is not False
+    ])
+    formdata['submit'] = 'y'
+    form = form_class(formdata=formdata, meta={'csrf': False})
+    options = survey.FLOW.nodes[number].options
+    if options is not None:
+        form.options.choices = options()
+    skipped = form_class._mode == 'radio' and form.options.data == 'None'
+    if not skipped and not form.validate():
+        return None, form.errors
+    data = copy(form.data)
+    data.pop('submit', None)
+    data.pop('csrf_token', None)
+    return data, None
+
+
+def replay(answers):
+    """Walk the flow in the session with a batch of answers.
+
+    Returns (answered questions, None) or (question, errors) at the first
+    invalid answer
+    """
+    number = next(iter(survey.FLOW.nodes))
+    answered = []
+    for _ in range(2 * len(survey.FLOW.nodes) + 1):
+        if isinstance(number, tuple):
+            number = number[-1]
+        if number == 'finish':
+            return [
+                question for question in answered
+                if 's_{}_a'.format(question) in session
+            ], None
+        target = survey.FLOW.check(number)
+        if target is not None:
+            number = target
+            continue
+        data, errors = question_data(number, answers.get(number, {}))
+        if errors is not None:
+            return number, errors
+        session['s_{}_a'.format(number)] = data
+        if number not in answered:
+            answered.append(number)
+        successor = survey.FLOW.successor[number]
+        number = successor() if callable(successor) else successor
+    return number, {'flow': ['The survey flow does not reach the end']}
+
+
+def reset_session(lang, origin):
+    """Keep only the language and origin of the session"""
+    session.clear()
+    session['s_lang'] = lang
+    session['s_origin'] = origin
+
+
+def submit_answers(answers):
+    """Replay and save a batch of answers as a finished respondent.
+
+    Returns (result, status)
+    """
+    lang = session['s_lang']
+    origin = session.get('s_origin', 'main')
+    previous = dict(session)
+    reset_session(lang, origin)
+    session['s_index'] = True
+    session['s_uid'] = binascii.hexlify(os.urandom(24))
+    answered, errors = replay(answers)
+    if errors is not None:
+        session.clear()
+        session.update(previous)
+        return {'question': answered, 'errors': errors}, 400
+    writes = []
+    if 's_uid' in previous:
+        writes.append((write_answer, (
+            previous['s_uid'], 'finish', lang, {'submit': 'restart'})))
+    writes += [answer_write('origin', {'submit': origin}),
+               answer_write('index', {'submit': 'yes'})]
+    writes += [answer_write(number) for number in answered]
+    writes.append(answer_write('finish', {'submit': 'final'}))
+    submit_all(writes, final=True)
+    reset_session(lang, origin)
+    session['s_minutes'] = gettext('Thank you')
+    session['s_url'] = 'finish'
+    return {'finished': True, 'answers': len(answered)}, 200
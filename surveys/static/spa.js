@@ -0,0 +1,295 @@
+/* Single-page survey: walks the survey flow in the browser and saves all
+   answers with one request. Texts come from /translation/<lang>/, the flow
+   and the fields from the #spa-state json rendered by the server, which
+   replays the same flow when the answers arrive. */
+(function ($) {
+  'use strict';
+
+  var LAST = '<last>';
+  var state = JSON.parse(document.getElementById('spa-state').textContent);
+  var root = $('#spa');
+  var texts = null;
+  var answers = {};
+  var visited = {};
+  var history = [];
+  var current = null;
+
+  function answer(number) {
+    return answers[number] || {};
+  }
+
+  function option(number, fallback) {
+    var value = answer(number).options;
+    if (value !== undefined) {
+      return value;
+    }
+    return fallback === undefined ? 'no' : fallback;
+  }
+
+  function t1Answers() {
+    var ans = answer('t1');
+    var items = [];
+    $.each(ans, function (key, value) {
+      if (key.indexOf('other') < 0 && value) {
+        items.push([key, texts.t1.answers[key]]);
+      }
+    });
+    if (ans.other_e) {
+      items.push(['other_e', 'other' in ans ? ans.other : texts.t1.answers.other]);
+    }
+    return items;
+  }
+
+  function oneOf(value, values) {
+    return values.indexOf(value) >= 0;
+  }
+
+  /* Predicates of the flow edges, by name. Mirror survey.py */
+  var predicates = {
+    no_experiments: function () {
+      return option('p2') === '0';
+    },
+    single_tool: function () {
+      return t1Answers().length <= 1;
+    },
+    unknown_preference: function () {
+      var tools = $.map(t1Answers(), function (item) { return item[0]; });
+      return !oneOf(option('t2', ''), tools.concat(['no']));
+    },
+    no_preference: function () {
+      return !!answer('t2').options && oneOf(option('t2', 'no'), ['no', 'None']);
+    },
+    unknown_provenance: function () {
+      return option('a1', '') === 'what_is_provenance';
+    },
+    no_provenance: function () {
+      return oneOf(option('a1', ''), ['no', 'None']);
+    },
+    single_database: function () {
+      return option('a4') === 'no';
+    },
+    no_contact: function () {
+      return option('c1') !== 'yes' && option('c2') !== 'yes';
+    }
+  };
+
+  var optionSources = {
+    preference_options: function () {
+      return t1Answers().concat([['no', texts.t2.answers.no]]);
+    }
+  };
+
+  function lastVisited() {
+    for (var i = state.order.length - 1; i >= 0; i--) {
+      if (visited[state.order[i]]) {
+        return state.order[i];
+      }
+    }
+    return state.order[0];
+  }
+
+  function erase(numbers) {
+    $.each(numbers, function (_, number) {
+      delete answers[number];
+      delete visited[number];
+    });
+  }
+
+  function follow(edge) {
+    erase(edge.erase);
+    return edge.target === LAST ? lastVisited() : edge.target;
+  }
+
+  function firstEdge(edges) {
+    for (var i = 0; i < edges.length; i++) {
+      if (edges[i].when === null || predicates[edges[i].when]()) {
+        return edges[i];
+      }
+    }
+    return null;
+  }
+
+  function radioChoices(number) {
+    var node = state.flow[number];
+    if (node.options) {
+      return optionSources[node.options]();
+    }
+    return $.map(texts[number].answer_order, function (raw) {
+      return [[raw, texts[number].answers[raw]]];
+    });
+  }
+
+  function labelOf(number, field) {
+    var key = /_e$/.test(field) ? field.slice(0, -2) : field;
+    return texts[number].answers[key] || '';
+  }
+
+  function input(type, name, value) {
+    return $('<input>').attr({type: type, name: name, value: value});
+  }
+
+  function renderField(number, field, ans, specified) {
+    var group = $('<div class="form-group">');
+    if (field.kind === 'radio') {
+      $.each(radioChoices(number), function (_, choice) {
+        var radio = input('radio', 'options', choice[0])
+          .prop('checked', ans.options === choice[0]);
+        group.append($('<div class="radio">').append(
+          $('<label>').append(radio, ' ', document.createTextNode(choice[1]))));
+      });
+    } else if (field.kind === 'bool') {
+      var box = input('checkbox', field.name, 'y').prop('checked', !!ans[field.name]);
+      group = $('<div class="checkbox">').append(
+        $('<label>').append(box, ' ', document.createTextNode(labelOf(number, field.name))));
+    } else if (field.kind === 'select') {
+      var select = $('<select class="form-control">').attr('name', field.name);
+      $.each(state.countries, function (_, country) {
+        select.append($('<option>').val(country[0]).text(country[1]));
+      });
+      group.append(select.val(ans[field.name] || ''));
+    } else {
+      var text = $(field.kind === 'textarea' ? '<textarea>' : '<input type="text">')
+        .addClass('form-control').attr('name', field.name).val(ans[field.name] || '');
+      if (specified) {
+        text.attr('placeholder', state.labels.specify);
+        group.addClass('specify').attr('data-for', specified);
+      } else if (labelOf(number, field.name)) {
+        group.append($('<label class="control-label">').text(labelOf(number, field.name)));
+      }
+      group.append(text);
+    }
+    return group;
+  }
+
+  function toggleSpecify(form) {
+    form.find('.specify').each(function () {
+      var box = form.find('input[name="' + $(this).data('for') + '"]');
+      $(this).toggle(box.prop('checked'));
+    });
+  }
+
+  function limitChecks(form, limit) {
+    var boxes = form.find('input[type=checkbox]');
+    var full = boxes.filter(':checked').length >= limit;
+    boxes.not(':checked').prop('disabled', full);
+  }
+
+  function render(number, errors) {
+    var question = state.questions[number];
+    var ans = answer(number);
+    var form = $('<form class="form" role="form">');
+    var specifies = {};
+    $.each(question.specify, function (box, text) { specifies[text] = box; });
+    $.each(question.fields, function (_, field) {
+      form.append(renderField(number, field, ans, specifies[field.name]));
+    });
+    $.each(errors || {}, function (_, messages) {
+      form.prepend($('<div class="alert alert-danger">').text(messages.join(' ')));
+    });
+    if (history.length > 1) {
+      form.append($('<button type="button" class="btn btn-default back">')
+        .text(state.labels.back), ' ');
+    }
+    form.append($('<button type="submit" class="btn btn-default">')
+      .text(state.labels.next));
+    form.on('change', 'input[type=checkbox]', function () {
+      toggleSpecify(form);
+      if (question.limit) {
+        limitChecks(form, question.limit);
+      }
+    });
+    form.on('click', '.back', back);
+    form.on('submit', function (event) {
+      event.preventDefault();
+      answers[number] = collect(form, question);
+      next();
+    });
+    root.empty().append($('<h3>').text(texts[number].title), form);
+    toggleSpecify(form);
+    if (question.limit) {
+      limitChecks(form, question.limit);
+    }
+    if ($.fn.select2) {
+      form.find('select').select2();
+    }
+  }
+
+  function collect(form, question) {
+    var data = {};
+    $.each(question.fields, function (_, field) {
+      if (field.kind === 'radio') {
+        data.options = form.find('input[name=options]:checked').val() || 'None';
+      } else if (field.kind === 'bool') {
+        data[field.name] = form.find('input[name="' + field.name + '"]').prop('checked');
+      } else {
+        data[field.name] = form.find('[name="' + field.name + '"]').val();
+      }
+    });
+    return data;
+  }
+
+  function show(number) {
+    while (number !== 'finish') {
+      visited[number] = true;
+      var guard = firstEdge(state.flow[number].guards);
+      if (guard === null) {
+        break;
+      }
+      number = follow(guard);
+    }
+    if (number === 'finish') {
+      submit();
+      return;
+    }
+    current = number;
+    history.push(number);
+    render(number);
+  }
+
+  function next() {
+    show(follow(firstEdge(state.flow[current].next)));
+  }
+
+  function back() {
+    history.pop();
+    current = history[history.length - 1];
+    render(current);
+  }
+
+  function submit() {
+    var batch = {};
+    $.each(state.order, function (_, number) {
+      if (visited[number] && answers[number]) {
+        batch[number] = answers[number];
+      }
+    });
+    $.ajax({
+      url: state.submit,
+      method: 'POST',
+      contentType: 'application/json',
+      data: JSON.stringify({answers: batch}),
+      headers: {'X-CSRFToken': root.data('csrf')},
+      dataType: 'json'
+    }).done(function () {
+      root.empty().append(
+        $('<h1>').text(state.labels.thanks),
+        $('<p>').append($('<a class="btn btn-lg btn-default" role="button">')
+          .attr('href', window.location.pathname).text(state.labels.restart)));
+    }).fail(function (xhr) {
+      var result = xhr.responseJSON || {};
+      if (result.question && state.questions[result.question]) {
+        current = result.question;
+        history.push(current);
+        render(current, result.errors);
+      } else {
+        root.prepend($('<div class="alert alert-danger">')
+          .text(JSON.stringify(result.errors || xhr.statusText)));
+      }
+    });
+  }
+
+  $.getJSON(state.translation, function (catalog) {
+    texts = catalog;
+    show(state.order[0]);
+  });
+}(jQuery));
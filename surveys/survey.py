@@ -11,10 +11,12 @@ from flask_babel import gettext, lazy_gettext
 
 from itertools import chain
 
+from .catalog import local_title
 from .db import db, Answer
 
-from .helper import erase, goto, question_form, radio_question, last, answer
-from .helper import option, set_navbar, survey_question, save_answer
+from .flow import Flow, Node, Edge, LAST
+from .helper import goto, question_form, radio_question, answer
+from .helper import option, set_navbar, save_answer
 
 from .forms import StartForm, NextForm
 from .forms import Education, ExperimentCount, Domains, Experience, Situations
@@ -77,9 +79,10 @@ TITLES = {
 ORDER = [x.upper() for x in FORMS.keys()] + ['finish']
 
 
-def form(number, next_question, title, options=None):
+def form(number, next_question, options=None):
     """Question Form based on Form type"""
     form_class = FORMS[number]
+    title = local_title(number, TITLES[number])
     question_function = (
         question_form if form_class._mode != 'radio' else radio_question
     )
@@ -113,196 +116,104 @@ def index():
     return render_template('index.html', form=form)
 
 
-@survey_question('index', 5)
-def p1():
-    """Q1/P1"""
-    title = TITLES['p1']
-    return form('p1', 'p2', title)
-
-
-@survey_question('p1', 5)
-def p2():
-    """Q2/P2"""
-    title = TITLES['p2']
-    return form('p2', (lambda: 'p3' if option('p2') != '0' else 'finish'), title)
-
-
-@survey_question('p2', 5)
-def p3():
-    """Q3/P3"""
-    title = TITLES['p3']
-    return form('p3', 'p4', title)
-
-
-@survey_question('p3', 5)
-def p4():
-    """Q4/P4"""
-    title = TITLES['p4']
-    return form('p4', 'p5', title)
-
-
-@survey_question('p4', 5)
-def p5():
-    """Q5/P5"""
-    title = TITLES['p5']
-    return form('p5', 'p6', title)
-
-@survey_question('p5', 5)
-def p6():
-    """NQ1/P6"""
-    title = TITLES['p6']
-    return form('p6', 't1', title)
-
 def t1_answers():
     ans = answer('t1')
+    labels = Tools.survey_schema().labels
     items = [
-        (k, getattr(Tools, k).args[0]) for k, v in ans.items()
+        (k, labels[k]) for k, v in ans.items()
         if 'other' not in k
         if v
     ]
     if "other_e" in ans and ans["other_e"]:
         items.append(
             ('other_e', ans['other']) if 'other' in ans else
-            ('other_e', getattr(Tools, 'other_e').args[0])
+            ('other_e', labels['other_e'])
         )
     return items
 
 
-@survey_question('p6', 4)
-def t1():
-    """Q6/T1"""
-    title = TITLES['t1']
-    def redir():
-        t1_ans = t1_answers()
-        if len(t1_ans) <= 1:
-            erase(['t2', 't3'])
-            return 'i1'
-        if option('t2', '') not in {k for k, v in chain(t1_ans, [("no", 0)])}:
-            erase(['t2', 't3'])
-        return 't2'
-
-    return form('t1', redir, title)
-
-
-@survey_question('t1', 4)
-def t2():
-    """Q7/T2"""
-    title = TITLES['t2']
-    t1_ans = t1_answers()
-    if len(t1_ans) <= 1:
-        erase(['t2', 't3'])
-        return goto('i1')
-
-    options = t1_ans + Preference.options.kwargs['choices'][-1:]
-    return form('t2', 't3', title, options=options)
-
-
-@survey_question('t2', 4)
-def t3():
-    """Q8/T3"""
-    title = TITLES['t3']
-    if answer('t2').get('options', {}) and option('t2', 'no') in {'no', 'None'}:
-        erase('t3')
-        return goto('i1')
-    return form('t3', 'i1', title)
-
-
-@survey_question('t1', 3)
-def i1():
-    """Q9/I1"""
-    title = TITLES['i1']
-    return form('i1', 'i2', title)
-
-
-@survey_question('i1', 3)
-def i2():
-    """Q10/I2"""
-    title = TITLES['i2']
-    return form('i2', 'a1', title)
-
-
-@survey_question('i2', 3)
-def a1():
-    """Q11/A1"""
-    title = TITLES['a1']
-    return form('a1', 'a2', title)
-
-
-@survey_question('a1', 2)
-def a2():
-    """Q12/A2"""
-    title = TITLES['a2']
-    if option('a1', '') in {'what_is_provenance',}:
-        erase(['a2', 'a3', 'a4', 'a5'])
-        return goto('c1')
-    return form('a2', 'a3', title)
-
-
-@survey_question('a2', 2)
-def a3():
-    """Q13/A3"""
-    title = TITLES['a3']
-    if option('a1', '') in {'what_is_provenance',}:
-        erase(['a2', 'a3', 'a4', 'a5'])
-        return goto(last(ORDER))
-    if option('a1', '') in {'no', 'None'}:
-        erase(['a3', 'a4', 'a5'])
-        return goto('c1')
-    return form('a3', 'a4', title)
-
-
-@survey_question('a3', 2)
-def a4():
-    """Q14/A4"""
-    title = TITLES['a4']
-    return form('a4', 'a5', title)
-
-
-@survey_question('a4', 2)
-def a5():
-    """Q15/A5"""
-    title = TITLES['a5']
-    if option('a4') == 'no':
-        erase('a5')
-        return goto('c1')
-    return form('a5', 'c1', title)
-
-
-@survey_question('a1', 1)
-def c1():
-    """Q16/C1"""
-    title = TITLES['c1']
-    return form('c1', 'c2', title)
-
-
-@survey_question('c1', 1)
-def c2():
-    """Q17/C2"""
-    title = TITLES['c2']
-    return form('c2', 'c3', title)
-
-
-@survey_question('c2', 1)
-def c3():
-    """Q18/C3"""
-    title = TITLES['c3']
-    if all(option(x) != 'yes' for x in ['c1', 'c2']):
-        erase('c3')
-        return goto('p7')
-    return form('c3', 'p7', title)
-
-@survey_question([('c2', 'c3')], 1)
-def p7():
-    """NQ2/P7"""
-    title = TITLES['p7']
-    return form('p7', 'p8', title)
-
-
-@survey_question('p7', 1)
-def p8():
-    """NQ3/P8"""
-    title = TITLES['p8']
-    return form('p8', 'finish', title)
+def no_experiments():
+    """P2: never ran an experiment"""
+    return option('p2') == '0'
+
+
+def single_tool():
+    """T1: at most one tool"""
+    return len(t1_answers()) <= 1
+
+
+def unknown_preference():
+    """T1: T2 answer is no longer one of the T1 tools"""
+    tools = {k for k, v in chain(t1_answers(), [("no", 0)])}
+    return option('t2', '') not in tools
+
+
+def no_preference():
+    """T2: no favorite tool"""
+    return bool(answer('t2').get('options', {})) and \
+        option('t2', 'no') in {'no', 'None'}
+
+
+def preference_options():
+    """T2: T1 tools and 'no'"""
+    return t1_answers() + Preference.options.kwargs['choices'][-1:]
+
+
+def unknown_provenance():
+    """A1: does not know what provenance is"""
+    return option('a1', '') in {'what_is_provenance',}
+
+
+def no_provenance():
+    """A1: never analyzed provenance"""
+    return option('a1', '') in {'no', 'None'}
+
+
+def single_database():
+    """A4: never analyzed provenance databases together"""
+    return option('a4') == 'no'
+
+
+def no_contact():
+    """C1, C2: no contact allowed"""
+    return all(option(x) != 'yes' for x in ['c1', 'c2'])
+
+
+FLOW = Flow([
+    Node('p1', 'index', 5, 'p2'),
+    Node('p2', 'p1', 5, [Edge('finish', no_experiments), Edge('p3')]),
+    Node('p3', 'p2', 5, 'p4'),
+    Node('p4', 'p3', 5, 'p5'),
+    Node('p5', 'p4', 5, 'p6'),
+    Node('p6', 'p5', 5, 't1'),
+    Node('t1', 'p6', 4, [
+        Edge('i1', single_tool, ('t2', 't3')),
+        Edge('t2', unknown_preference, ('t2', 't3')),
+        Edge('t2'),
+    ]),
+    Node('t2', 't1', 4, 't3',
+         guards=[Edge('i1', single_tool, ('t2', 't3'))],
+         options=preference_options),
+    Node('t3', 't2', 4, 'i1', guards=[Edge('i1', no_preference, ('t3',))]),
+    Node('i1', 't1', 3, 'i2'),
+    Node('i2', 'i1', 3, 'a1'),
+    Node('a1', 'i2', 3, 'a2'),
+    Node('a2', 'a1', 2, 'a3', guards=[
+        Edge('c1', unknown_provenance, ('a2', 'a3', 'a4', 'a5')),
+    ]),
+    Node('a3', 'a2', 2, 'a4', guards=[
+        Edge(LAST, unknown_provenance, ('a2', 'a3', 'a4', 'a5')),
+        Edge('c1', no_provenance, ('a3', 'a4', 'a5')),
+    ]),
+    Node('a4', 'a3', 2, 'a5'),
+    Node('a5', 'a4', 2, 'c1', guards=[Edge('c1', single_database, ('a5',))]),
+    Node('c1', 'a1', 1, 'c2'),
+    Node('c2', 'c1', 1, 'c3'),
+    Node('c3', 'c2', 1, 'p7', guards=[Edge('p7', no_contact, ('c3',))]),
+    Node('p7', ('c2', 'c3'), 1, 'p8'),
+    Node('p8', 'p7', 1, 'finish'),
+], ORDER)
+
 
 @set_navbar(lazy_gettext('Thank you'))
 def finish():
@@ -316,3 +227,7 @@ def finish():
     session['s_url'] = 'finish'
     session['s_origin'] = origin
     return render_template('finish.html')
+
+
+# Views of the /<lang>/<number>/ routes
+ROUTES = dict(FLOW.views(form), index=index, finish=finish)
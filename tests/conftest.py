@@ -0,0 +1,41 @@
+"""Fixtures: an app on a scratch SQLite database"""
+import os
+import tempfile
+
+import pytest
+
+# default_config reads the environment when the first app is created
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+    tempfile.mkdtemp(), 'test.db')
+os.environ['SURVEY_SPA_MODE'] = '1'
+
+from surveys import create_app, db  # noqa: E402 pylint: disable=wrong-import-position
+from surveys.bench import CSRF_RE  # noqa: E402 pylint: disable=wrong-import-position
+
+
+@pytest.fixture
+def app():
+    """App with empty tables"""
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    """Test client of a respondent who started the survey in English.
+
+    csrf_token is the token of its session
+    """
+    client = app.test_client()
+    page = client.get('/en/').get_data(as_text=True)
+    client.post('/en/', data={
+        'submit': 'Start', 'csrf_token': CSRF_RE.search(page).group(1)})
+    page = client.get('/en/p1/').get_data(as_text=True)
+    client.csrf_token = CSRF_RE.search(page).group(1)
+    return client
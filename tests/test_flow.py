@@ -0,0 +1,189 @@
+"""Redirects of the survey flow, including skips, back-jumps and erased answers"""
+from urllib.parse import urlparse
+
+from surveys.db import Answer
+
+# Answers that visit every question
+ANSWERS = {
+    'p1': {'options': 'phd'},
+    'p2': {'options': '2_to_5'},
+    'p3': {'computer': 'y'},
+    'p4': {'options': '1_to_2'},
+    'p5': {'phd': 'y'},
+    'p6': {'country': 'BRA'},
+    't1': {'python': 'y', 'r_lang': 'y'},
+    't2': {'options': 'python'},
+    't3': {'setup': 'y'},
+    'i1': {'options': 'no'},
+    'i2': {'options': '3'},
+    'a1': {'options': 'yes'},
+    'a2': {'comprehensive_2': 'y'},
+    'a3': {'SQL': 'y'},
+    'a4': {'options': 'yes'},
+    'a5': {'options': 'yes'},
+    'c1': {'options': 'yes'},
+    'c2': {'options': 'yes'},
+    'c3': {'email': 'respondent@example.com'},
+    'p7': {'institution': 'UFF', 'role': 'student'},
+    'p8': {'comment': 'none'},
+}
+
+
+def target(response):
+    """Return the question a redirect points to"""
+    assert response.status_code == 302
+    number = urlparse(response.headers['Location']).path.strip('/')
+    number = number.rsplit('/', 1)[-1]
+    return 'index' if number == 'en' else number
+
+
+def submit(client, number, answer=None):
+    """Post an answer. Return the question it redirects to"""
+    data = dict(ANSWERS[number] if answer is None else answer,
+                submit='Next', csrf_token=client.csrf_token)
+    return target(client.post('/en/{}/'.format(number), data=data))
+
+
+def visit(client, number):
+    """Get a question. Return the question it redirects to or None"""
+    response = client.get('/en/{}/'.format(number))
+    if response.status_code == 200:
+        return None
+    return target(response)
+
+
+def walk(client, stop, **answers):
+    """Answer from p1 until stop is the next question"""
+    number = 'p1'
+    while number != stop:
+        number = submit(client, number, answers.get(number))
+
+
+def stored(app, *numbers):
+    """Return the number of answer rows of questions"""
+    with app.app_context():
+        return Answer.query.filter(Answer.question.in_(numbers)).count()
+
+
+def session_keys(client):
+    """Return the session keys of the client"""
+    with client.session_transaction() as state:
+        return set(state)
+
+
+def test_walk_every_question(client):
+    number = 'p1'
+    order = []
+    while number != 'finish':
+        assert visit(client, number) is None
+        order.append(number)
+        number = submit(client, number)
+    assert order == list(ANSWERS)
+
+
+def test_not_started(app):
+    client = app.test_client()
+    assert visit(client, 'p1') == 'index'
+    assert visit(client, 'c3') == 'index'
+
+
+def test_requires_previous_question(client):
+    assert visit(client, 'p3') == 'p2'
+    assert visit(client, 'p2') is None
+    assert visit(client, 'p7') == 'c3'
+
+
+def test_unknown_question_goes_to_last_visited(client):
+    walk(client, 'p4')
+    assert visit(client, 'zz') == 'p3'
+    assert visit(client, 'p4') is None
+    assert visit(client, 'zz') == 'p4'
+
+
+def test_no_experiments(client):
+    submit(client, 'p1')
+    assert submit(client, 'p2', {'options': '0'}) == 'finish'
+
+
+def test_single_tool_skips_preference(client):
+    walk(client, 't1')
+    assert submit(client, 't1', {'python': 'y'}) == 'i1'
+    assert visit(client, 't2') == 'i1'
+    assert visit(client, 't3') == 't2'
+
+
+def test_back_to_single_tool_erases_preference(app, client):
+    walk(client, 'i1')
+    assert stored(app, 't2', 't3') == 2
+    assert submit(client, 't1', {'python': 'y'}) == 'i1'
+    assert not session_keys(client) & {'s_t2', 's_t2_a', 's_t3', 's_t3_a'}
+    assert stored(app, 't2', 't3') == 0
+    assert submit(client, 'i1') == 'i2'
+
+
+def test_changed_tools_erase_unknown_preference(app, client):
+    walk(client, 'i1')
+    assert submit(client, 't1', {'python': 'y', 'julia': 'y'}) == 't2'
+    assert stored(app, 't2', 't3') == 2
+    assert submit(client, 't1', {'r_lang': 'y', 'julia': 'y'}) == 't2'
+    assert not session_keys(client) & {'s_t2_a', 's_t3', 's_t3_a'}
+    assert stored(app, 't2', 't3') == 0
+
+
+def test_no_preference_skips_reasons(app, client):
+    walk(client, 't2')
+    assert submit(client, 't2', {'options': 'no'}) == 't3'
+    assert visit(client, 't3') == 'i1'
+    assert 's_t3' not in session_keys(client)
+    assert submit(client, 'i1') == 'i2'
+
+
+def test_unknown_provenance_skips_analysis(client):
+    walk(client, 'a1')
+    assert submit(client, 'a1', {'options': 'what_is_provenance'}) == 'a2'
+    assert visit(client, 'a2') == 'c1'
+    assert visit(client, 'a3') == 'a2'
+    assert submit(client, 'c1') == 'c2'
+
+
+def test_back_to_unknown_provenance_goes_to_last_visited(app, client):
+    walk(client, 'c2')
+    assert stored(app, 'a2', 'a3', 'a4', 'a5') == 4
+    assert submit(client, 'a1', {'options': 'what_is_provenance'}) == 'a2'
+    assert visit(client, 'a3') == 'c1'
+    assert not session_keys(client) & {'s_a2', 's_a3', 's_a4', 's_a5'}
+    assert stored(app, 'a2', 'a3', 'a4', 'a5') == 0
+
+
+def test_no_provenance_skips_tools(app, client):
+    walk(client, 'c2')
+    assert submit(client, 'a1', {'options': 'no'}) == 'a2'
+    assert submit(client, 'a2') == 'a3'
+    assert visit(client, 'a3') == 'c1'
+    assert stored(app, 'a2') == 1
+    assert stored(app, 'a3', 'a4', 'a5') == 0
+
+
+def test_single_database_skips_a5(app, client):
+    walk(client, 'c1')
+    assert submit(client, 'a4', {'options': 'no'}) == 'a5'
+    assert visit(client, 'a5') == 'c1'
+    assert stored(app, 'a5') == 0
+
+
+def test_no_contact_skips_email(app, client):
+    walk(client, 'c1')
+    assert submit(client, 'c1', {'options': 'no'}) == 'c2'
+    assert submit(client, 'c2', {'options': 'no'}) == 'c3'
+    assert visit(client, 'c3') == 'p7'
+    assert submit(client, 'p7') == 'p8'
+    assert submit(client, 'p8') == 'finish'
+
+
+def test_back_to_contact_erases_email(app, client):
+    walk(client, 'p7')
+    assert stored(app, 'c3') == 1
+    submit(client, 'c1', {'options': 'no'})
+    submit(client, 'c2', {'options': 'no'})
+    assert visit(client, 'c3') == 'p7'
+    assert stored(app, 'c3') == 0
@@ -0,0 +1,50 @@
+"""Batch submissions of the single-page survey"""
+import json
+import re
+
+import pytest
+
+from surveys.db import Answer
+
+SPA_CSRF_RE = re.compile(r'data-csrf="([^"]*)"')
+
+
+def post(client, answers):
+    """Submit a batch from the single-page survey. Return the response"""
+    page = client.get('/spa/en/').get_data(as_text=True)
+    return client.post(
+        '/spa/en/answers/', data=json.dumps({'answers': answers}),
+        content_type='application/json',
+        headers={'X-CSRFToken': SPA_CSRF_RE.search(page).group(1)})
+
+
+def session_uid(client):
+    """Return the respondent id of the client session"""
+    with client.session_transaction() as state:
+        return state.get('s_uid')
+
+
+@pytest.mark.parametrize('answers', [
+    {'p1': 'phd'},
+    {'p1': ['phd']},
+    {'p1': {'options': ['phd']}},
+    {'p1': {'options': {'value': 'phd'}}},
+])
+def test_malformed_answers(app, client, answers):
+    uid = session_uid(client)
+    response = post(client, answers)
+    assert response.status_code == 400
+    assert json.loads(response.get_data(as_text=True))['question'] == 'p1'
+    assert session_uid(client) == uid
+    with app.app_context():
+        assert Answer.query.filter_by(question='finish').count() == 0
+
+
+def test_scalar_answers(app, client):
+    response = post(client, {'p1': {'options': 'phd'}, 'p2': {'options': 0}})
+    assert response.status_code == 200
+    assert json.loads(response.get_data(as_text=True))['answers'] == 2
+    with app.app_context():
+        finish = {answer.value for answer in
+                  Answer.query.filter_by(question='finish')}
+    assert finish == {'restart', 'final'}